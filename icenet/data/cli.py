@@ -165,6 +165,9 @@ def process_args(dates: bool = True,
     if dates:
         add_date_args(ap)
 
+    ap.add_argument("-a", "--append",
+                    default=False, action="store_true",
+                    help="Only process dates newer than the processed data")
     ap.add_argument("-l", "--lag", type=int, default=2)
     ap.add_argument("-f", "--forecast", type=int, default=93)
     ap.add_argument("-p", "--parallel-opens",
@@ -195,6 +198,9 @@ def process_args(dates: bool = True,
         ap.add_argument("-r", "--ref",
                         help="Reference loader for normalisations etc",
                         default=None, type=str)
+    ap.add_argument("-s", "--store",
+                    help="Store processed data as NetCDF files or Zarr stores",
+                    choices=("netcdf", "zarr"), default="netcdf")
     ap.add_argument("-v", "--verbose", action="store_true", default=False)
 
     ap.add_argument("-u", "--update-key",
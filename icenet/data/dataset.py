@@ -45,12 +45,21 @@ class IceNetDataSet(SplittingMixin, DataCollection):
                          south=bool(self._config["south"]),
                          **kwargs)
 
+        self._active_cells = np.load(self._config["active_cells"]) \
+            if "active_cells" in self._config and \
+            self._config["active_cells"] else None
         self._batch_size = batch_size
+        self._compression = self._config["compression"] \
+            if "compression" in self._config else None
         self._counts = self._config["counts"]
         self._dtype = getattr(np, self._config["dtype"])
         self._loader_config = self._config["loader_config"]
         self._n_forecast_days = self._config["n_forecast_days"]
         self._num_channels = self._config["num_channels"]
+        self._output_dtype = self._config["output_dtype"] \
+            if "output_dtype" in self._config else None
+        self._record_version = self._config["record_version"] \
+            if "record_version" in self._config else 1
         self._shape = tuple(self._config["shape"])
         self._shuffling = shuffling
 
@@ -150,11 +159,16 @@ class MergedIceNetDataSet(SplittingMixin, DataCollection):
                          south=bool(self._config["south"]),
                          **kwargs)
 
+        self._active_cells = np.load(self._config["active_cells"]) \
+            if self._config["active_cells"] else None
         self._base_path = path
         self._batch_size = batch_size
+        self._compression = self._config["compression"]
         self._dtype = getattr(np, self._config["dtype"])
         self._num_channels = self._config["num_channels"]
         self._n_forecast_days = self._config["n_forecast_days"]
+        self._output_dtype = self._config["output_dtype"]
+        self._record_version = self._config["record_version"]
         self._shape = self._config["shape"]
         self._shuffling = shuffling
 
@@ -226,8 +240,32 @@ class MergedIceNetDataSet(SplittingMixin, DataCollection):
                 logging.info("Merging {} samples from {}".format(count, dataset))
                 self._config["counts"][dataset] += count
 
-        general_attrs = ["channels", "dtype", "n_forecast_days",
-                         "num_channels", "output_batch_size", "shape"]
+        for attr, default in (("active_cells", None),
+                              ("compression", None),
+                              ("output_dtype", None),
+                              ("record_version", 1)):
+            if attr not in other:
+                other[attr] = default
+
+        # Each dataset saves its own index table, so it is the tables that
+        # have to be the same rather than their paths
+        other_cells = np.load(other["active_cells"]) \
+            if other["active_cells"] else None
+
+        if "active_cells" not in self._config:
+            self._config["active_cells"] = other["active_cells"]
+        else:
+            cells = np.load(self._config["active_cells"]) \
+                if self._config["active_cells"] else None
+            assert (cells is None and other_cells is None) or \
+                (cells is not None and other_cells is not None and
+                 np.array_equal(cells, other_cells)), \
+                "active_cells is not the same across configurations"
+
+        general_attrs = ["channels", "compression", "dtype",
+                         "n_forecast_days", "num_channels",
+                         "output_batch_size", "output_dtype",
+                         "record_version", "shape"]
 
         for attr in general_attrs:
             if attr not in self._config:
@@ -10,33 +10,91 @@ def get_decoder(shape: object,
                 channels: object,
                 forecasts: object,
                 num_vars: int = 1,
-                dtype: str = "float32") -> object:
+                active_cells: object = None,
+                dtype: str = "float32",
+                output_dtype: str = None,
+                record_version: int = 1) -> object:
     """
 
     :param shape:
     :param channels:
     :param forecasts:
     :param num_vars:
+    :param active_cells: index table for records holding only active cells
     :param dtype:
+    :param output_dtype: reduced precision storage of y and sample_weights
+    :param record_version: the encoding the records were written with
     :return:
     """
-    xf = tf.io.FixedLenFeature(
-        [*shape, channels], getattr(tf, dtype))
-    yf = tf.io.FixedLenFeature(
-        [*shape, forecasts, num_vars], getattr(tf, dtype))
-    sf = tf.io.FixedLenFeature(
-        [*shape, forecasts, num_vars], getattr(tf, dtype))
-
-    @tf.function
-    def decode_item(proto):
+    x_shape = [*shape, channels]
+    y_shape = [*shape, forecasts, num_vars]
+
+    if record_version < 2:
+        xf = tf.io.FixedLenFeature(x_shape, getattr(tf, dtype))
+        yf = tf.io.FixedLenFeature(y_shape, getattr(tf, dtype))
+        sf = tf.io.FixedLenFeature(y_shape, getattr(tf, dtype))
+
+        @tf.function
+        def decode_item(proto):
+            features = {
+                "x": xf,
+                "y": yf,
+                "sample_weights": sf,
+            }
+
+            item = tf.io.parse_example(proto, features)
+            return item['x'], item['y'], item['sample_weights']
+    else:
         features = {
-            "x": xf,
-            "y": yf,
-            "sample_weights": sf,
+            name: tf.io.FixedLenFeature([], tf.string)
+            for name in ("x", "y", "sample_weights")
         }
-
-        item = tf.io.parse_example(proto, features)
-        return item['x'], item['y'], item['sample_weights']
+        output_type = getattr(tf, dtype) \
+            if output_dtype is None else getattr(tf, output_dtype)
+
+        stored_shape = y_shape
+
+        if output_dtype == "uint8":
+            features["sample_weights_scale"] = tf.io.FixedLenFeature(
+                [forecasts, num_vars], tf.float32)
+
+        if active_cells is not None:
+            features["active_month"] = tf.io.FixedLenFeature([], tf.int64)
+            stored_shape = [-1, forecasts, num_vars]
+            cells = tf.constant(active_cells, dtype=tf.int32)
+            dense_shape = [shape[0] * shape[1], forecasts, num_vars]
+
+            def densify(values, month):
+                idx = cells[month][:tf.shape(values)[0]]
+                return tf.reshape(
+                    tf.scatter_nd(idx[:, tf.newaxis], values, dense_shape),
+                    y_shape)
+
+        @tf.function
+        def decode_item(proto):
+            item = tf.io.parse_example(proto, features)
+
+            x = tf.reshape(
+                tf.io.decode_raw(item['x'], getattr(tf, dtype)), x_shape)
+            y = tf.reshape(
+                tf.io.decode_raw(item['y'], output_type), stored_shape)
+            sw = tf.reshape(
+                tf.io.decode_raw(item['sample_weights'], output_type),
+                stored_shape)
+
+            if output_dtype is not None:
+                y = tf.cast(y, getattr(tf, dtype))
+                sw = tf.cast(sw, getattr(tf, dtype))
+
+            if output_dtype == "uint8":
+                y = y / 255.
+                sw = sw / 255. * tf.cast(item['sample_weights_scale'],
+                                         getattr(tf, dtype))
+
+            if active_cells is not None:
+                y = densify(y, item['active_month'])
+                sw = densify(sw, item['active_month'])
+            return x, y, sw
 
     return decode_item
 
@@ -48,10 +106,14 @@ class SplittingMixin:
 
     """
 
+    _active_cells: object
     _batch_size: int
+    _compression: str
     _dtype: object
     _num_channels: int
     _n_forecast_days: int
+    _output_dtype: str
+    _record_version: int
     _shape: int
     _shuffling: bool
 
@@ -113,10 +175,13 @@ class SplittingMixin:
 
         train_ds, val_ds, test_ds = \
             tf.data.TFRecordDataset(self.train_fns,
+                                    compression_type=self.compression,
                                     num_parallel_reads=self.batch_size), \
             tf.data.TFRecordDataset(self.val_fns,
+                                    compression_type=self.compression,
                                     num_parallel_reads=self.batch_size), \
             tf.data.TFRecordDataset(self.test_fns,
+                                    compression_type=self.compression,
                                     num_parallel_reads=self.batch_size),
 
         # TODO: Comparison/profiling runs
@@ -126,7 +191,10 @@ class SplittingMixin:
         decoder = get_decoder(self.shape,
                               self.num_channels,
                               self.n_forecast_days,
-                              dtype=self.dtype.__name__)
+                              active_cells=self.active_cells,
+                              dtype=self.dtype.__name__,
+                              output_dtype=self.output_dtype,
+                              record_version=self.record_version)
 
         if self.shuffling:
             logging.info("Training dataset(s) marked to be shuffled")
@@ -158,12 +226,16 @@ class SplittingMixin:
         decoder = get_decoder(self.shape,
                               self.num_channels,
                               self.n_forecast_days,
-                              dtype=self.dtype.__name__)
+                              active_cells=self.active_cells,
+                              dtype=self.dtype.__name__,
+                              output_dtype=self.output_dtype,
+                              record_version=self.record_version)
 
         for df in getattr(self, "{}_fns".format(split)):
             logging.debug("Getting records from {}".format(df))
             try:
-                raw_dataset = tf.data.TFRecordDataset([df])
+                raw_dataset = tf.data.TFRecordDataset(
+                    [df], compression_type=self.compression)
                 raw_dataset = raw_dataset.map(decoder)
 
                 for i, (x, y, sw) in enumerate(raw_dataset):
@@ -206,10 +278,18 @@ class SplittingMixin:
                 logging.warning("{}: tensorflow error {}".format(df, e.message))
             # We don't except any non-tensorflow errors to prevent progression
 
+    @property
+    def active_cells(self):
+        return self._active_cells
+
     @property
     def batch_size(self):
         return self._batch_size
 
+    @property
+    def compression(self):
+        return self._compression
+
     @property
     def dtype(self):
         return self._dtype
@@ -222,6 +302,14 @@ class SplittingMixin:
     def num_channels(self):
         return self._num_channels
 
+    @property
+    def output_dtype(self):
+        return self._output_dtype
+
+    @property
+    def record_version(self):
+        return self._record_version
+
     @property
     def shape(self):
         return self._shape
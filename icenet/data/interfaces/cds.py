@@ -71,6 +71,11 @@ class ERA5Downloader(ClimateDownloader):
             )
             self.client.session.mount("https://", adapter)
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["client"] = None
+        return state
+
     def _single_toolbox_download(self,
                                  var: object,
                                  level: object,
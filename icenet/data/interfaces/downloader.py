@@ -4,9 +4,10 @@ import os
 import re
 import shutil
 import tempfile
+import threading
 
 from abc import abstractmethod
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from itertools import product
 
 from icenet.data.sic.mask import Masks
@@ -15,16 +16,21 @@ from icenet.data.producers import Downloader
 from icenet.data.utils import assign_lat_lon_coord_system, \
     gridcell_angles_from_dim_coords, \
     invert_gridcell_angles, \
+    regrid_weights, \
+    regrid_weights_key, \
+    regrid_with_weights, \
     rotate_grid_vectors
-from icenet.data.interfaces.utils import batch_requested_dates
+from icenet.data.interfaces.utils import append_netcdf, \
+    batch_requested_dates
 from icenet.utils import run_command
 
+import dask
 import iris
-import iris.analysis
 import iris.cube
 import iris.exceptions
 import numpy as np
 import pandas as pd
+import scipy.sparse
 import xarray as xr
 
 """
@@ -92,36 +98,49 @@ def filter_dates_on_data(latlon_path: str,
 def merge_files(new_datafile: str,
                 other_datafile: str,
                 drop_variables: object = None):
-    """
+    """Merges new data into existing data, see append_netcdf
 
-    :param new_datafile:
-    :param other_datafile:
+    :param new_datafile: removed once merged into other_datafile
+    :param other_datafile: existing data, or None if there is nothing to merge
     :param drop_variables:
     """
     drop_variables = list() if drop_variables is None else drop_variables
 
     if other_datafile is not None:
-        (datafile_path, new_filename) = os.path.split(new_datafile)
-        moved_new_datafile = \
-            os.path.join(datafile_path, "new.{}".format(new_filename))
-        os.rename(new_datafile, moved_new_datafile)
-        d1 = xr.open_dataarray(moved_new_datafile,
-                               drop_variables=drop_variables)
-
-        logging.info("Concatenating with previous data {}".format(
-            other_datafile
+        logging.info("Merging {} into previous data {}".format(
+            new_datafile, other_datafile
         ))
-        d2 = xr.open_dataarray(other_datafile,
-                               drop_variables=drop_variables)
-        new_ds = xr.concat([d1, d2], dim="time").\
-            sortby("time").\
-            drop_duplicates("time", keep="first")
 
-        logging.info("Saving merged data to {}... ".
-                     format(new_datafile))
-        new_ds.to_netcdf(new_datafile)
-        os.unlink(other_datafile)
-        os.unlink(moved_new_datafile)
+        with xr.open_dataarray(new_datafile,
+                               drop_variables=drop_variables) as new_da:
+            append_netcdf(new_da.load(), other_datafile, drop_variables)
+        os.unlink(new_datafile)
+
+
+# Each regrid process holds its own copy of the downloader
+_regrid_downloader = None
+
+
+def _init_regrid_process(downloader: object):
+    """
+
+    :param downloader: the ClimateDownloader to regrid with
+    """
+    global _regrid_downloader
+    _regrid_downloader = downloader
+
+    # Parallelism comes from the processes, and a forked process can
+    # inherit an unusable thread pool from its parent
+    dask.config.set(scheduler="synchronous")
+
+
+def _regrid_process_files(datafiles: object) -> list:
+    """
+
+    :param datafiles:
+    :return: see ClimateDownloader.regrid_files
+    """
+    return _regrid_downloader.regrid_files(datafiles)
 
 
 class ClimateDownloader(Downloader):
@@ -165,7 +184,10 @@ class ClimateDownloader(Downloader):
         self._max_threads = max_threads
         self._postprocess = postprocess
         self._pregrid_prefix = pregrid_prefix
+        self._regrid_weights = dict()
+        self._regrid_weights_lock = threading.Lock()
         self._rotatable_files = []
+        self._sic_ease_angles = dict()
         self._sic_ease_cubes = dict()
         self._var_name_idx = var_name_idx
         self._var_names = list(var_names)
@@ -182,6 +204,18 @@ class ClimateDownloader(Downloader):
 
         self._validate_config()
 
+    def __getstate__(self):
+        # Pickled for the regrid processes, which have no use for the files
+        # downloaded, and subclasses drop their API clients
+        state = self.__dict__.copy()
+        del state["_regrid_weights_lock"]
+        state["_files_downloaded"] = list()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._regrid_weights_lock = threading.Lock()
+
     def _validate_config(self):
         """
 
@@ -378,102 +412,275 @@ class ClimateDownloader(Downloader):
                 'projection_y_coordinate').convert_units('meters')
         return self._sic_ease_cubes[self._hemisphere]
 
+    @property
+    def sic_ease_angles(self):
+        """Angles to rotate vectors on the EASE grid to, derived once
+
+        :return: cube of true_east_from_gridcell_angle
+        """
+        if self._hemisphere not in self._sic_ease_angles:
+            angles = gridcell_angles_from_dim_coords(self.sic_ease_cube)
+            invert_gridcell_angles(angles)
+            self._sic_ease_angles[self._hemisphere] = angles
+        return self._sic_ease_angles[self._hemisphere]
+
     def regrid(self,
                files: object = None,
-               rotate_wind: bool = True):
-        """
+               rotate_wind: bool = True,
+               retries: int = 2,
+               workers: int = None):
+        """Regrids downloaded files to the EASE grid in a pool of processes
+
+        Each file, or pair of wind component files to rotate, is regridded as
+        a separate task and merged with any existing data as soon as it
+        completes. Tasks still failing after their retries are raised once
+        the others have completed
 
         :param files:
+        :param rotate_wind:
+        :param retries: further attempts to make for a task that fails
+        :param workers: processes to regrid with, defaults to max_threads
         """
         filelist = self._files_downloaded if not files else files
-        batches = [filelist[b:b + 1000] for b in range(0, len(filelist), 1000)]
-
-        max_workers = min(len(batches), self._max_threads)
-        regrid_results = list()
-
-        if max_workers > 0:
-            with ThreadPoolExecutor(max_workers=max_workers) \
-                    as executor:
-                futures = []
-
-                for files in batches:
-                    future = executor.submit(self._batch_regrid, files)
-                    futures.append(future)
-
-                for future in concurrent.futures.as_completed(futures):
-                    try:
-                        fut_results = future.result()
-
-                        for res in fut_results:
-                            logging.debug("Future result -> regrid_results: {}".
-                                          format(res))
-                            regrid_results.append(res)
-                    except Exception as e:
-                        logging.exception("Thread failure: {}".format(e))
+        tasks = self.get_regrid_tasks(filelist, rotate_wind=rotate_wind)
+
+        workers = min(len(tasks),
+                      self._max_threads if workers is None else workers)
+
+        if workers > 0:
+            # Make sure the grid, its angles and the weights for each source
+            # grid are available to the processes before they start, rather
+            # than each deriving them
+            logging.debug("Regridding to {}".format(self.sic_ease_cube.name()))
+
+            if rotate_wind:
+                logging.debug("Rotating with {}".format(
+                    self.sic_ease_angles.name()))
+
+            grid_files = {os.path.dirname(datafile): datafile
+                          for datafiles in tasks for datafile in datafiles}
+
+            for datafile in grid_files.values():
+                try:
+                    self.get_regrid_weights(
+                        self.convert_cube(iris.load_cube(datafile)))
+                except Exception as e:
+                    # Left for the processes to handle, and report
+                    logging.debug("No regrid weights from {}: {}".
+                                  format(datafile, e))
+
+            failures = list()
+
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_regrid_process,
+                                     initargs=(self,)) as executor:
+                attempts = {executor.submit(_regrid_process_files, datafiles):
+                            (datafiles, 0) for datafiles in tasks}
+
+                while len(attempts) > 0:
+                    done, _ = concurrent.futures.wait(
+                        attempts,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+
+                    for future in done:
+                        datafiles, attempt = attempts.pop(future)
+
+                        try:
+                            fut_results = future.result()
+                        except Exception as e:
+                            if attempt < retries:
+                                logging.warning("Regrid failure for {}, "
+                                                "retrying: {}".format(
+                                                    ", ".join(datafiles), e))
+                                attempts[executor.submit(
+                                    _regrid_process_files, datafiles)] = \
+                                    (datafiles, attempt + 1)
+                            else:
+                                logging.exception("Regrid failure for {} "
+                                                  "after {} attempts".
+                                                  format(", ".join(datafiles),
+                                                         attempt + 1))
+                                failures.append(datafiles)
+                            continue
+
+                        for new_datafile, other_datafile in fut_results:
+                            logging.debug("Regrid result: {}".
+                                          format(new_datafile))
+                            merge_files(new_datafile,
+                                        other_datafile,
+                                        self._drop_vars)
+
+            if len(failures):
+                failed_files = [datafile for datafiles in failures
+                                for datafile in datafiles]
+                raise RuntimeError("Regridding failed for {} of {} tasks: {}".
+                                   format(len(failures), len(tasks),
+                                          ", ".join(failed_files)))
         else:
             logging.info("No regrid batches to processing, moving on...")
 
-        if rotate_wind:
-            logging.info("Rotating wind data prior to merging")
-            self.rotate_wind_data()
-
-        for new_datafile, moved_datafile in regrid_results:
-            merge_files(new_datafile, moved_datafile, self._drop_vars)
+    def get_regrid_tasks(self,
+                         files: object,
+                         apply_to: object = ("uas", "vas"),
+                         rotate_wind: bool = True) -> list:
+        """Groups files to regrid, pairing wind components for rotation
 
-    def _batch_regrid(self,
-                      files: object):
+        :param files:
+        :param apply_to: the wind component variables
+        :param rotate_wind:
+        :return: list of tuples of one file, or a pair of wind files
         """
+        tasks = list()
+        wind_files = {var: dict() for var in apply_to}
 
-        :param files:
+        for datafile in files:
+            path_parts = os.path.dirname(datafile).split(os.sep)
+            var_name = path_parts[self._var_name_idx]
+
+            if not rotate_wind or var_name not in apply_to:
+                tasks.append((datafile, ))
+                continue
+
+            # Components of the same date have the same name in otherwise
+            # identical paths, other than their variable name
+            path_parts[self._var_name_idx] = None
+            key = (tuple(path_parts),
+                   re.sub(r'^(?:{})?(?:{}_)?'.format(self.pregrid_prefix,
+                                                     var_name),
+                          '', os.path.basename(datafile)))
+            wind_files[var_name][key] = datafile
+
+        if wind_files[apply_to[0]].keys() != wind_files[apply_to[1]].keys():
+            unpaired = set(wind_files[apply_to[0]].keys()).\
+                symmetric_difference(wind_files[apply_to[1]].keys())
+            raise RuntimeError("Wind files are not all paired for rotation: "
+                               "{}".format(", ".join(sorted(
+                                   key[1] for key in unpaired))))
+
+        for key, datafile in sorted(wind_files[apply_to[0]].items()):
+            tasks.append((datafile, wind_files[apply_to[1]][key]))
+        return tasks
+
+    def regrid_files(self,
+                     datafiles: object) -> list:
+        """Regrids downloaded files, run in the regrid processes
+
+        A pair of wind component files are rotated in memory, before either
+        is saved
+
+        :param datafiles: a single file, or a pair of u and v wind files
+        :return: list of tuples of each regridded file and any existing data
+            to merge it into
         """
+        cubes = [self._regrid_cube(datafile) for datafile in datafiles]
+
+        if len(datafiles) == 2:
+            if any(cube is None for cube in cubes):
+                raise RuntimeError("Cannot rotate {} without both components".
+                                   format(", ".join(datafiles)))
+
+            logging.info("Rotating {}".format(", ".join(datafiles)))
+            cubes = rotate_grid_vectors(*cubes, self.sic_ease_angles)
+
         results = list()
 
-        for datafile in files:
+        for datafile, cube_ease in zip(datafiles, cubes):
+            if cube_ease is None:
+                continue
+
             (datafile_path, datafile_name) = os.path.split(datafile)
 
             new_filename = re.sub(r'^{}'.format(
                 self.pregrid_prefix), '', datafile_name)
             new_datafile = os.path.join(datafile_path, new_filename)
 
-            moved_datafile = None
-
             if os.path.exists(new_datafile):
-                moved_filename = "moved.{}".format(new_filename)
-                moved_datafile = os.path.join(datafile_path, moved_filename)
-                os.rename(new_datafile, moved_datafile)
+                # Saved alongside, to be merged into the existing data
+                save_datafile = os.path.join(datafile_path,
+                                             "new.{}".format(new_filename))
+                results.append((save_datafile, new_datafile))
+            else:
+                save_datafile = new_datafile
+                results.append((new_datafile, None))
 
-                logging.info("{} already existed, moved to {}".
-                             format(new_filename, moved_filename))
+            logging.info("Saving regridded data to {}... ".
+                         format(save_datafile))
+            iris.save(cube_ease, save_datafile,
+                      fill_value=np.nan,
+                      unlimited_dimensions=["time"])
 
-            logging.debug("Regridding {}".format(datafile))
+        if self.delete:
+            for datafile in datafiles:
+                if os.path.exists(datafile):
+                    logging.info("Removing {}".format(datafile))
+                    os.remove(datafile)
 
-            try:
-                cube = iris.load_cube(datafile)
-                cube = self.convert_cube(cube)
+        return results
 
-                cube_ease = cube.regrid(
-                    self.sic_ease_cube, iris.analysis.Linear())
+    def _regrid_cube(self,
+                     datafile: str) -> object:
+        """
 
-            except iris.exceptions.CoordinateNotFoundError:
-                logging.warning("{} has no coordinates...".
-                                format(datafile_name))
-                if self.delete:
-                    logging.debug("Deleting failed file {}...".
-                                  format(datafile_name))
-                    os.unlink(datafile)
-                continue
+        :param datafile:
+        :return: the regridded cube, or None if the file has no coordinates
+        """
+        datafile_name = os.path.basename(datafile)
+        logging.debug("Regridding {}".format(datafile))
 
-            self.additional_regrid_processing(datafile, cube_ease)
+        try:
+            cube = iris.load_cube(datafile)
+            cube = self.convert_cube(cube)
 
-            logging.info("Saving regridded data to {}... ".format(new_datafile))
-            iris.save(cube_ease, new_datafile, fill_value=np.nan)
-            results.append((new_datafile, moved_datafile))
+            cube_ease = regrid_with_weights(
+                cube, self.sic_ease_cube, self.get_regrid_weights(cube))
 
+        except iris.exceptions.CoordinateNotFoundError:
+            logging.warning("{} has no coordinates...".
+                            format(datafile_name))
             if self.delete:
-                logging.info("Removing {}".format(datafile))
-                os.remove(datafile)
+                logging.debug("Deleting failed file {}...".
+                              format(datafile_name))
+                os.unlink(datafile)
+            return None
 
-        return results
+        self.additional_regrid_processing(datafile, cube_ease)
+        return cube_ease
+
+    def get_regrid_weights(self, cube: object) -> object:
+        """Weights to regrid cube to the EASE grid, computed once per grid
+
+        The weights are held for the lifetime of the downloader and saved
+        alongside the data, so that later downloads of the same source grid
+        reuse them
+
+        :param cube: the converted cube to be regridded
+        :return: scipy.sparse.csr_matrix, see icenet.data.utils.regrid_weights
+        """
+        key = regrid_weights_key(cube, self.sic_ease_cube)
+
+        with self._regrid_weights_lock:
+            if key not in self._regrid_weights:
+                weights_file = os.path.join(
+                    self.get_data_var_folder("regrid_weights"),
+                    "{}.npz".format(key))
+
+                if os.path.exists(weights_file):
+                    logging.debug("Loading regrid weights from {}".
+                                  format(weights_file))
+                    weights = scipy.sparse.load_npz(weights_file)
+                else:
+                    logging.info("Computing regrid weights to {}".
+                                 format(weights_file))
+                    weights = regrid_weights(cube, self.sic_ease_cube)
+
+                    # Other downloaders might be reading the same file
+                    tmp_file = "{}.{}.tmp.npz".format(
+                        os.path.splitext(weights_file)[0], os.getpid())
+                    scipy.sparse.save_npz(tmp_file, weights)
+                    os.replace(tmp_file, weights_file)
+
+                self._regrid_weights[key] = weights
+        return self._regrid_weights[key]
 
     def convert_cube(self, cube: object):
         """Converts Iris cube to be fit for regrid
@@ -508,8 +715,7 @@ class ClimateDownloader(Downloader):
                                    "there should only be two.".\
             format(", ".join(apply_to))
 
-        angles = gridcell_angles_from_dim_coords(self.sic_ease_cube)
-        invert_gridcell_angles(angles)
+        angles = self.sic_ease_angles
 
         logging.info("Rotating wind data in {}".format(
             " ".join([self.get_data_var_folder(v) for v in apply_to])))
@@ -93,6 +93,11 @@ retrieve,
 
         self._server = ecmwfapi.ECMWFService("mars")
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_server"] = None
+        return state
+
     def _single_download(self,
                          var_names: object,
                          pressures: object,
@@ -4,6 +4,8 @@ import glob
 import logging
 import os
 
+import netCDF4
+import numpy as np
 import pandas as pd
 import xarray as xr
 
@@ -45,6 +47,121 @@ def batch_requested_dates(dates: object,
     return batched_dates
 
 
+def append_netcdf(da: object,
+                  path: str,
+                  drop_variables: object = None):
+    """Merges the times of da into the NetCDF file at path
+
+    Times later than those in the file are appended along its unlimited time
+    dimension, and times already in the file are overwritten, in place. This
+    means regular updates only write the new data. Otherwise the whole file
+    is rewritten in time order, with an unlimited time dimension so that
+    later updates can be appended.
+
+    :param da: data to merge, taking precedence over that in the file
+    :param path:
+    :param drop_variables: variables to ignore in the file when rewriting
+    """
+    drop_variables = list() if drop_variables is None else drop_variables
+    da = da.sortby("time")
+
+    if not os.path.exists(path):
+        logging.info("Saving {}".format(path))
+        da.to_netcdf(path, unlimited_dims=["time"])
+        return
+
+    with netCDF4.Dataset(path, "a") as nc:
+        appended = _append_netcdf_in_place(da, nc)
+
+    if appended:
+        logging.info("Appended {} dates to {}".format(len(da.time), path))
+        return
+
+    logging.info("Rewriting {} to merge {} dates".format(path, len(da.time)))
+
+    with xr.open_dataarray(path, drop_variables=drop_variables) as old_da:
+        merged_da = xr.concat([da, old_da], dim="time").\
+            sortby("time").\
+            drop_duplicates("time", keep="first").\
+            load()
+
+    temp_path = os.path.join(os.path.dirname(path),
+                             "temp.{}".format(os.path.basename(path)))
+    merged_da.to_netcdf(temp_path, unlimited_dims=["time"])
+    os.replace(temp_path, path)
+
+
+def _append_netcdf_in_place(da: object,
+                            nc: object) -> bool:
+    """Writes da into an open netCDF4.Dataset, if it can be done in place
+
+    :param da: sorted by time
+    :param nc:
+    :return: whether da was written
+    """
+    if "time" not in nc.dimensions \
+            or "time" not in nc.variables \
+            or not nc.dimensions["time"].isunlimited() \
+            or not hasattr(nc.variables["time"], "units"):
+        return False
+
+    time_var = nc.variables["time"]
+    times = da.time.values
+
+    if np.issubdtype(times.dtype, np.datetime64):
+        times = pd.to_datetime(times).to_pydatetime()
+
+    times = np.asarray(netCDF4.date2num(
+        times, time_var.units,
+        calendar=getattr(time_var, "calendar", "standard")))
+
+    if np.issubdtype(time_var.dtype, np.integer):
+        if not np.array_equal(times, np.round(times)):
+            return False
+        times = np.round(times)
+
+    # Only the time variable is read to work out where the dates belong
+    file_times = np.asarray(time_var[:])
+    exists = np.isin(times, file_times)
+
+    if len(file_times) > 0 and \
+            np.any(times[~exists] <= np.max(file_times)):
+        return False
+
+    time_vars = {name: var for name, var in nc.variables.items()
+                 if "time" in var.dimensions and name != "time"}
+
+    time_das = {name: da if name == da.name else da.coords.get(name)
+                for name in time_vars.keys()}
+
+    # Anything else in the file that varies in time has to come from da
+    for name, var in time_vars.items():
+        if time_das[name] is None \
+                or set(var.dimensions) != set(time_das[name].dims):
+            return False
+
+    # Times already in the file are overwritten, the rest go on the end
+    writes = [(np.flatnonzero(file_times == time)[0], idx)
+              for idx, time in enumerate(times) if exists[idx]]
+
+    if not np.all(exists):
+        writes.append((len(file_times), np.flatnonzero(~exists)[0]))
+
+    for file_index, da_index in writes:
+        n = 1 if exists[da_index] else int(np.sum(~exists))
+        file_slice = slice(int(file_index), int(file_index) + n)
+        da_slice = slice(da_index, da_index + n)
+
+        time_var[file_slice] = times[da_slice]
+
+        for name, var in time_vars.items():
+            slicer = [slice(None)] * len(var.dimensions)
+            slicer[var.dimensions.index("time")] = file_slice
+            var[tuple(slicer)] = time_das[name].isel(time=da_slice).\
+                transpose(*var.dimensions).values
+    return True
+
+
 def reprocess_monthlies(source: str,
                         hemisphere: str,
                         identifier: str,
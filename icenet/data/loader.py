@@ -25,6 +25,9 @@ def create_get_args():
     ap.add_argument("name", type=str)
     ap.add_argument("hemisphere", choices=("north", "south"))
 
+    ap.add_argument("-b", "--batch-mode",
+                    help="Generate each output batch in one vectorised pass",
+                    default=False, action="store_true", dest="batch_mode")
     ap.add_argument("-c", "--cfg-only", help="Do not generate data, "
                                              "only config", default=False,
                     action="store_true", dest="cfg")
@@ -47,9 +50,15 @@ def create_get_args():
 
     ap.add_argument("-ob", "--output-batch-size", dest="batch_size", type=int,
                     default=8)
+    ap.add_argument("-od", "--output-dtype", dest="output_dtype",
+                    help="Reduced precision storage of outputs and weights",
+                    choices=("float16", "uint8"), default=None)
 
     ap.add_argument("-p", "--pickup", help="Skip existing tfrecords",
                     default=False, action="store_true")
+    ap.add_argument("-s", "--sparse",
+                    help="Store only active cells of outputs and weights",
+                    default=False, action="store_true")
     ap.add_argument("-t", "--tmp-dir", help="Temporary directory",
                     default="/local/tmp", dest="tmp_dir", type=str)
 
@@ -57,6 +66,8 @@ def create_get_args():
     ap.add_argument("-w", "--workers", help="Number of workers to use "
                                             "generating sets",
                     type=int, default=2)
+    ap.add_argument("-z", "--compression", help="Compress the tfrecords",
+                    choices=("GZIP", "ZLIB"), default=None)
 
     add_date_args(ap)
     args = ap.parse_args()
@@ -75,6 +86,8 @@ def create():
         "loader.{}.json".format(args.name),
         args.forecast_name if args.forecast_name else args.name,
         args.lag,
+        batch_mode=args.batch_mode,
+        compression=args.compression,
         dates_override=dates
         if sum([len(v) for v in dates.values()]) > 0 else None,
         dry=args.dry,
@@ -82,7 +95,9 @@ def create():
         north=args.hemisphere == "north",
         south=args.hemisphere == "south",
         output_batch_size=args.batch_size,
+        output_dtype=args.output_dtype,
         pickup=args.pickup,
+        sparse=args.sparse,
         generate_workers=args.workers,
         dask_port=args.dask_port,
         futures_per_worker=args.futures)
@@ -9,6 +9,7 @@ from pprint import pformat
 import numpy as np
 
 from icenet.data.process import IceNetPreProcessor
+from icenet.data.loaders.utils import OUTPUT_DTYPES, RECORD_VERSION
 from icenet.data.producers import Generator
 
 """
@@ -22,12 +23,15 @@ class IceNetBaseDataLoader(Generator):
     :param configuration_path,
     :param identifier,
     :param var_lag,
+    :param compression: GZIP or ZLIB compression of the records
     :param dataset_config_path:
     :param generate_workers:
     :param loss_weight_days:
     :param n_forecast_days:
     :param output_batch_size:
+    :param output_dtype: float16 or uint8 storage of y and sample weights
     :param path:
+    :param sparse: store only the active cells of y and sample weights
     :param var_lag_override:
     """
 
@@ -36,6 +40,7 @@ class IceNetBaseDataLoader(Generator):
                  identifier: str,
                  var_lag: int,
                  *args,
+                 compression: str = None,
                  dataset_config_path: str = ".",
                  dates_override: object = None,
                  dry: bool = False,
@@ -43,8 +48,10 @@ class IceNetBaseDataLoader(Generator):
                  loss_weight_days: bool = True,
                  n_forecast_days: int = 93,
                  output_batch_size: int = 32,
+                 output_dtype: str = None,
                  path: str = os.path.join(".", "network_datasets"),
                  pickup: bool = False,
+                 sparse: bool = False,
                  var_lag_override: object = None,
                  **kwargs):
         super().__init__(*args,
@@ -52,9 +59,11 @@ class IceNetBaseDataLoader(Generator):
                          path=path,
                          **kwargs)
 
+        self._active_cells = None
         self._channels = dict()
         self._channel_files = dict()
 
+        self._compression = compression
         self._configuration_path = configuration_path
         self._dataset_config_path = dataset_config_path
         self._dates_override = dates_override
@@ -65,7 +74,9 @@ class IceNetBaseDataLoader(Generator):
         self._missing_dates = []
         self._n_forecast_days = n_forecast_days
         self._output_batch_size = output_batch_size
+        self._output_dtype = output_dtype
         self._pickup = pickup
+        self._sparse = sparse
         self._trend_steps = dict()
         self._workers = generate_workers
 
@@ -83,6 +94,15 @@ class IceNetBaseDataLoader(Generator):
             dt.datetime.strptime(s, IceNetPreProcessor.DATE_FORMAT)
             for s in self._config["missing_dates"]]
 
+        if self._compression not in (None, "GZIP", "ZLIB"):
+            raise RuntimeError("Compression {} is not GZIP or ZLIB".
+                               format(self._compression))
+
+        if self._output_dtype not in OUTPUT_DTYPES:
+            raise RuntimeError("Output dtype {} is not one of {}".
+                               format(self._output_dtype,
+                                      ", ".join(OUTPUT_DTYPES[1:])))
+
     def write_dataset_config_only(self):
         """
 
@@ -277,15 +297,26 @@ class IceNetBaseDataLoader(Generator):
                 return x.strftime(IceNetPreProcessor.DATE_FORMAT)
             return str(x)
 
+        active_cells_path = None
+
+        if network_dataset and self._active_cells is not None:
+            active_cells_path = os.path.abspath(os.path.join(
+                self.base_path, self.hemisphere_str[0], "active_cells.npy"))
+            logging.info("Writing active cell indexes to {}".
+                         format(active_cells_path))
+            np.save(active_cells_path, self._active_cells)
+
         configuration = {
             "identifier":       self.identifier,
             "implementation":   self.__class__.__name__,
+            "active_cells":     active_cells_path,
             # This is only for convenience ;)
             "channels":         [
                 "{}_{}".format(channel, i)
                 for channel, s in
                 self._channels.items()
                 for i in range(1, s + 1)],
+            "compression":      self._compression,
             "counts":           counts,
             "dtype":            self._dtype.__name__,
             "loader_config":    os.path.abspath(self._configuration_path),
@@ -295,6 +326,7 @@ class IceNetBaseDataLoader(Generator):
             "n_forecast_days":  self._n_forecast_days,
             "north":            self.north,
             "num_channels":     self.num_channels,
+            "record_version":   RECORD_VERSION,
             # FIXME: this naming is inconsistent, sort it out!!! ;)
             "shape":            list(self._shape),
             "south":            self.south,
@@ -304,6 +336,7 @@ class IceNetBaseDataLoader(Generator):
             "dataset_path":     self._path if network_dataset else False,
             "loss_weight_days": self._loss_weight_days,
             "output_batch_size": self._output_batch_size,
+            "output_dtype":     self._output_dtype,
             "var_lag":          self._var_lag,
             "var_lag_override": self._var_lag_override,
         }
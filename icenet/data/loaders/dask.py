@@ -15,7 +15,9 @@ import xarray as xr
 
 from icenet.data.process import IceNetPreProcessor
 from icenet.data.loaders.base import IceNetBaseDataLoader
-from icenet.data.loaders.utils import IceNetDataWarning, write_tfrecord
+from icenet.data.loaders.utils import \
+    IceNetDataWarning, SampleWeightCache, get_active_cell_indexes, \
+    open_processed_dataset, store_kwargs, write_tfrecord
 from icenet.data.sic.mask import Masks
 
 
@@ -113,14 +115,24 @@ class DaskMultiSharingWorkerLoader(DaskBaseDataLoader):
 class DaskMultiWorkerLoader(DaskBaseDataLoader):
     def __init__(self,
                  *args,
+                 batch_mode: bool = False,
                  futures_per_worker: int = 2,
                  **kwargs):
         super().__init__(*args, **kwargs)
 
         masks = Masks(north=self.north, south=self.south)
-        self._masks = da.array([
-            masks.get_active_cell_mask(month) for month in range(1, 13)])
-
+        active_masks = masks.get_active_cell_masks()
+        self._masks = SampleWeightCache(
+            active_masks,
+            dtype=self._dtype,
+            loss_weight_days=self._loss_weight_days,
+            missing_dates=self._missing_dates)
+
+        if self._sparse:
+            self._active_cells = get_active_cell_indexes(
+                active_masks, self._n_forecast_days)
+
+        self._batch_mode = batch_mode
         self._futures = futures_per_worker
 
     def client_generate(self,
@@ -155,6 +167,8 @@ class DaskMultiWorkerLoader(DaskBaseDataLoader):
                 i += num
 
         masks = client.scatter(self._masks, broadcast=True)
+        active_cells = client.scatter(self._active_cells, broadcast=True) \
+            if self._active_cells is not None else None
 
         for dataset in splits:
             batch_number = 0
@@ -204,7 +218,11 @@ class DaskMultiWorkerLoader(DaskBaseDataLoader):
                                         self.get_sample_files(),
                                         dates,
                                         args,
-                                        dry=self._dry)
+                                        active_cells=active_cells,
+                                        batch_mode=self._batch_mode,
+                                        compression=self._compression,
+                                        dry=self._dry,
+                                        output_dtype=self._output_dtype)
                     futures.append(fut)
 
                     # Use this to limit the future list, to avoid crashing the
@@ -255,7 +273,7 @@ class DaskMultiWorkerLoader(DaskBaseDataLoader):
         )
         var_files = self.get_sample_files()
 
-        var_ds = xr.open_mfdataset(
+        var_ds = open_processed_dataset(
             [v for k, v in var_files.items()
              if k not in self._meta_channels
              and not k.endswith("linear_trend")],
@@ -268,7 +286,7 @@ class DaskMultiWorkerLoader(DaskBaseDataLoader):
         trend_ds = None
         
         if len(trend_files) > 0:
-            trend_ds = xr.open_mfdataset(
+            trend_ds = open_processed_dataset(
                 trend_files,
                 **ds_kwargs)
 
@@ -300,14 +318,22 @@ def generate_and_write(path: str,
                        var_files: object,
                        dates: object,
                        args: tuple,
-                       dry: bool = False):
+                       active_cells: object = None,
+                       batch_mode: bool = False,
+                       compression: str = None,
+                       dry: bool = False,
+                       output_dtype: str = None):
     """
 
     :param path:
     :param var_files:
     :param dates:
     :param args:
+    :param active_cells: index table to store only active cells
+    :param batch_mode: generate all dates in one vectorised pass
+    :param compression: GZIP or ZLIB record compression
     :param dry:
+    :param output_dtype: storage for y and sample_weights
     :return:
     """
     count = 0
@@ -333,7 +359,7 @@ def generate_and_write(path: str,
         parallel=True,
     )
 
-    var_ds = xr.open_mfdataset(
+    var_ds = open_processed_dataset(
         [v for k, v in var_files.items()
          if k not in meta_channels and not k.endswith("linear_trend")],
         **ds_kwargs)
@@ -344,39 +370,211 @@ def generate_and_write(path: str,
     trend_ds = None
 
     if len(trend_files):
-        trend_ds = xr.open_mfdataset(
+        trend_ds = open_processed_dataset(
             trend_files,
             **ds_kwargs)
         trend_ds = trend_ds.transpose("yc", "xc", "time")
 
-    with tf.io.TFRecordWriter(path) as writer:
-        for date in dates:
+    options = tf.io.TFRecordOptions(compression_type=compression) \
+        if compression else None
+
+    with tf.io.TFRecordWriter(path, options=options) as writer:
+        if batch_mode:
             start = time.time()
 
-            try:
-                x, y, sample_weights = generate_sample(date,
-                                                       var_ds,
-                                                       var_files,
-                                                       trend_ds,
-                                                       *args)
-                if not dry:
-                    x[da.isnan(x)] = 0.
-
-                    x, y, sample_weights = dask.compute(x, y, sample_weights,
-                                                        optimize_graph=True)
+            x, y, sample_weights = generate_batch(dates,
+                                                  var_ds,
+                                                  var_files,
+                                                  trend_ds,
+                                                  *args)
+            if not dry:
+                x[np.isnan(x)] = 0.
+
+                for i in range(len(dates)):
                     write_tfrecord(writer,
-                                   x, y, sample_weights)
-                count += 1
-            except IceNetDataWarning:
-                continue
+                                   x[i], y[i], sample_weights[i],
+                                   active_cells=active_cells,
+                                   month=dates[i].month,
+                                   output_dtype=output_dtype)
+            count = len(dates)
 
             end = time.time()
-            times.append(end - start)
-            logging.debug("Time taken to produce {}: {}".
-                          format(date, times[-1]))
+            times = [(end - start) / len(dates)] * len(dates)
+            logging.debug("Time taken to produce batch of {}: {}".
+                          format(len(dates), end - start))
+        else:
+            for date in dates:
+                start = time.time()
+
+                try:
+                    x, y, sample_weights = generate_sample(date,
+                                                           var_ds,
+                                                           var_files,
+                                                           trend_ds,
+                                                           *args)
+                    if not dry:
+                        x[da.isnan(x)] = 0.
+
+                        x, y, sample_weights = dask.compute(
+                            x, y, sample_weights, optimize_graph=True)
+                        write_tfrecord(writer,
+                                       x, y, sample_weights,
+                                       active_cells=active_cells,
+                                       month=date.month,
+                                       output_dtype=output_dtype)
+                    count += 1
+                except IceNetDataWarning:
+                    continue
+
+                end = time.time()
+                times.append(end - start)
+                logging.debug("Time taken to produce {}: {}".
+                              format(date, times[-1]))
     return path, count, times
 
 
+def gather_time_indexes(data_array: object,
+                        dates: object) -> tuple:
+    """Select an array of dates from a (yc, xc, time) DataArray in one isel
+
+    Every unique time index required is loaded with a single vectorised isel,
+    then redistributed to the shape of the requested dates in NumPy.
+
+    :param data_array: DataArray with time as the last dimension
+    :param dates: array of datetime64 values, of any shape
+    :return: tuple of (array of shape (yc, xc, *dates.shape), boolean array
+        of dates.shape which is False where a date was unavailable)
+    """
+    dates = np.asarray(dates, dtype="datetime64[ns]")
+    time_idx = data_array.indexes["time"].get_indexer(dates.ravel())
+    found = time_idx >= 0
+
+    unique_idx = np.unique(time_idx[found])
+    data = np.zeros((*data_array.shape[:-1], len(time_idx)),
+                    dtype=data_array.dtype)
+
+    if len(unique_idx):
+        selected = data_array.isel(time=unique_idx).to_numpy()
+        data[..., found] = selected[...,
+                                    np.searchsorted(unique_idx,
+                                                    time_idx[found])]
+    return (data.reshape(*data_array.shape[:-1], *dates.shape),
+            found.reshape(dates.shape))
+
+
+def generate_batch(forecast_dates: object,
+                   var_ds: object,
+                   var_files: object,
+                   trend_ds: object,
+                   channels: object,
+                   dtype: object,
+                   loss_weight_days: bool,
+                   meta_channels: object,
+                   missing_dates: object,
+                   n_forecast_days: int,
+                   num_channels: int,
+                   shape: object,
+                   trend_steps: object,
+                   masks: object,
+                   prediction: bool = False):
+    """Vectorised equivalent of generate_sample over a batch of dates
+
+    Rather than building a task for every channel and date, each variable is
+    selected once for all the lags, leads and trend steps required by the
+    batch, and the x, y and sample_weights arrays are filled in NumPy.
+
+    :param forecast_dates:
+    :param var_ds:
+    :param var_files:
+    :param trend_ds:
+    :param channels:
+    :param dtype:
+    :param loss_weight_days:
+    :param meta_channels:
+    :param missing_dates:
+    :param n_forecast_days:
+    :param num_channels:
+    :param shape:
+    :param trend_steps:
+    :param masks:
+    :param prediction:
+    :return: tuple of x, y, sample_weights arrays with a leading batch axis
+    """
+    n_samples = len(forecast_dates)
+    sample_dates = pd.to_datetime(forecast_dates).values
+
+    def offset_dates(days):
+        return sample_dates[:, np.newaxis] + \
+            np.array(days, dtype="timedelta64[D]")[np.newaxis, :]
+
+    # (sample, leadtime) matrix of the dates being forecast
+    forecast_dts = offset_dates(range(n_forecast_days))
+
+    y = np.zeros((n_samples, *shape, n_forecast_days, 1), dtype=dtype)
+
+    if not prediction:
+        sample_output, found = gather_time_indexes(var_ds.siconca_abs,
+                                                   forecast_dts)
+
+        if not found.all():
+            logging.error("Issue selecting data for non-prediction sample, "
+                          "please review siconca ground-truth: dates {}".
+                          format(forecast_dts[~found]))
+            raise RuntimeError("Missing siconca ground-truth for {}".
+                               format(forecast_dts[~found]))
+        y[..., 0] = sample_output.transpose(2, 0, 1, 3)
+
+    # Masked recomposition of output, gathered from the precomputed weights
+    sample_weights = masks.get_weights(forecast_dts,
+                                       y=y[..., 0])[..., np.newaxis]
+
+    # INPUT FEATURES
+    x = np.zeros((n_samples, *shape, num_channels), dtype=dtype)
+    v1, v2 = 0, 0
+
+    for var_name, var_channels in channels.items():
+        if var_name in meta_channels:
+            continue
+
+        v2 += var_channels
+
+        if var_name.endswith("linear_trend"):
+            channel_ds = trend_ds
+            if isinstance(trend_steps, list):
+                channel_dates = offset_dates([int(n) for n in trend_steps])
+            else:
+                channel_dates = offset_dates(range(var_channels))
+        else:
+            channel_ds = var_ds
+            channel_dates = offset_dates([-n for n in range(var_channels)])
+
+        channel_data, _ = gather_time_indexes(getattr(channel_ds, var_name),
+                                              channel_dates)
+        x[..., v1:v2] = channel_data.transpose(2, 0, 1, 3)
+        v1 += var_channels
+
+    for var_name in meta_channels:
+        if channels[var_name] > 1:
+            raise RuntimeError("{} meta variable cannot have more than "
+                               "one channel".format(var_name))
+
+        meta_ds = xr.open_dataarray(var_files[var_name],
+                                    **store_kwargs(var_files[var_name]))
+
+        if var_name in ["sin", "cos"]:
+            ref_dates = [pd.Timestamp(2012,
+                                      pd.Timestamp(date).month,
+                                      pd.Timestamp(date).day)
+                         for date in sample_dates]
+            trig_vals = meta_ds.sel(time=ref_dates).to_numpy()
+            x[..., v1] = trig_vals[:, np.newaxis, np.newaxis]
+        else:
+            x[..., v1] = meta_ds.to_numpy()
+        v1 += channels[var_name]
+
+    return x, y, sample_weights
+
+
 def generate_sample(forecast_date: object,
                     var_ds: object,
                     var_files: object,
@@ -431,27 +629,17 @@ def generate_sample(forecast_date: object,
             raise RuntimeError(sic_ex)
         y[:, :, :, 0] = sample_output
 
-    # Masked recomposition of output
-    for leadtime_idx in range(n_forecast_days):
-        forecast_day = forecast_date + dt.timedelta(days=leadtime_idx)
-
-        if any([forecast_day == missing_date
-                for missing_date in missing_dates]):
-            sample_weight = da.zeros(shape, dtype)
-        else:
-            # Zero loss outside of 'active grid cells'
-            sample_weight = masks[forecast_day.month - 1]
-            sample_weight = sample_weight.astype(dtype)
-
-            # We can pick up nans, which messes up training
-            sample_weight[da.isnan(y[..., leadtime_idx, 0])] = 0
+    # Masked recomposition of output, gathered from the precomputed weights
+    sample_weights[..., 0] = masks.get_weights(
+        pd.to_datetime(forecast_dts).values[np.newaxis])[0]
 
-            # Scale the loss for each month s.t. March is
-            #   scaled by 1 and Sept is scaled by 1.77
-            if loss_weight_days:
-                sample_weight *= 33928. / sample_weight.sum()
+    # We can pick up nans, which messes up training
+    sample_weights[da.isnan(y)] = 0
 
-        sample_weights[:, :, leadtime_idx, 0] = sample_weight
+    if masks.loss_weight_days:
+        weight_sums = sample_weights.sum(axis=(0, 1))
+        sample_weights *= SampleWeightCache.WEIGHT_TOTAL / \
+            da.where(weight_sums > 0, weight_sums, np.inf)
 
     # INPUT FEATURES
     x = da.zeros((*shape, num_channels), dtype=dtype)
@@ -494,7 +682,8 @@ def generate_sample(forecast_date: object,
             raise RuntimeError("{} meta variable cannot have more than "
                                "one channel".format(var_name))
 
-        meta_ds = xr.open_dataarray(var_files[var_name])
+        meta_ds = xr.open_dataarray(var_files[var_name],
+                                    **store_kwargs(var_files[var_name]))
 
         if var_name in ["sin", "cos"]:
             ref_date = "2012-{}-{}".format(forecast_date.month,
@@ -1,26 +1,182 @@
+import numpy as np
+import pandas as pd
 import tensorflow as tf
+import xarray as xr
 
 
 """
 
 """
 
+# Version 1 records hold each tensor as a FloatList, version 2 holds the raw
+# buffer of each tensor with a shape and dtype header
+RECORD_VERSION = 2
+
+# Reduced precision storage for y and sample weights, which requires version
+# 2 records. uint8 stores y (SIC fraction) in 1/255 steps and sample weights
+# in 1/255 steps of each leadtime's maximum, which is stored alongside
+OUTPUT_DTYPES = (None, "float16", "uint8")
+
 
 class IceNetDataWarning(RuntimeWarning):
     pass
 
 
+class SampleWeightCache:
+    """Precomputed, normalised sample weights for each month of the year
+
+    The active cell masks are held as a compact uint8 stack with a scale factor
+    per month, so the weights for any set of forecast dates are gathered from
+    the stack rather than rebuilt. Only leadtimes where the ground truth has
+    NaNs need zeroing and rescaling individually.
+
+    :param masks: the twelve monthly active cell masks
+    :param dtype:
+    :param loss_weight_days:
+    :param missing_dates:
+    """
+
+    # Scale the loss for each month s.t. March is
+    #   scaled by 1 and Sept is scaled by 1.77
+    WEIGHT_TOTAL = 33928.
+
+    def __init__(self,
+                 masks: object,
+                 dtype: object = np.float32,
+                 loss_weight_days: bool = True,
+                 missing_dates: object = ()):
+        self._dtype = dtype
+        self._loss_weight_days = loss_weight_days
+        self._masks = np.asarray(masks).astype(np.uint8)
+        self._missing_dates = pd.to_datetime(list(missing_dates)).\
+            values.astype("datetime64[D]")
+
+        if loss_weight_days:
+            self._scales = (self.WEIGHT_TOTAL /
+                            self._masks.sum(axis=(1, 2))).astype(dtype)
+        else:
+            self._scales = np.ones(len(self._masks), dtype=dtype)
+
+    def get_weights(self,
+                    dates: object,
+                    y: object = None) -> object:
+        """
+
+        :param dates: array of forecast dates of shape (sample, leadtime)
+        :param y: optional ground truth of shape (sample, *shape, leadtime)
+        :return: weights of shape (sample, *shape, leadtime)
+        """
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        month_idx = pd.DatetimeIndex(dates.ravel()).month.values.\
+            reshape(dates.shape) - 1
+
+        scales = self._scales[month_idx]
+        scales[np.isin(dates, self._missing_dates)] = 0
+
+        weights = self._masks[month_idx].transpose(0, 2, 3, 1) * \
+            scales[:, np.newaxis, np.newaxis, :]
+        weights = weights.astype(self._dtype)
+
+        if y is not None:
+            nan_y = np.isnan(y)
+            samples, leads = np.nonzero(nan_y.any(axis=(1, 2)) & (scales > 0))
+
+            if len(samples):
+                corrected = weights[samples, :, :, leads]
+                corrected[nan_y[samples, :, :, leads]] = 0
+
+                if self._loss_weight_days:
+                    weight_sums = corrected.sum(axis=(1, 2))
+                    corrected *= (self.WEIGHT_TOTAL / np.where(
+                        weight_sums > 0, weight_sums, np.inf))[
+                        :, np.newaxis, np.newaxis].astype(self._dtype)
+                weights[samples, :, :, leads] = corrected
+        return weights
+
+    @property
+    def loss_weight_days(self):
+        return self._loss_weight_days
+
+
+def store_kwargs(path: str) -> dict:
+    """Backend arguments for opening a processed NetCDF file or Zarr store
+
+    :param path:
+    :return:
+    """
+    return dict(consolidated=True, engine="zarr") \
+        if path.rstrip("/").endswith(".zarr") else dict()
+
+
+def open_processed_dataset(paths: object, **kwargs) -> object:
+    """Open processed files, which can be NetCDF files or Zarr stores
+    depending on how each source was preprocessed
+
+    :param paths:
+    :param kwargs: arguments for xarray.open_mfdataset
+    :return:
+    """
+    zarr_paths = [path for path in paths if store_kwargs(path)]
+    nc_paths = [path for path in paths if path not in zarr_paths]
+
+    datasets = [xr.open_mfdataset(group, **store_kwargs(group[0]), **kwargs)
+                for group in (nc_paths, zarr_paths) if len(group)]
+    return datasets[0] if len(datasets) == 1 else xr.merge(datasets)
+
+
+def get_active_cell_indexes(masks: object,
+                            n_forecast_days: int) -> object:
+    """Flat indexes of the cells that can be active for forecasts from each
+    month, padded with -1 to a (12, max cells) table
+
+    A forecast from a given month runs on into the following months, so the
+    index set for that month is the union of the active cell masks of every
+    month its leadtimes can reach. Only these cells of y and sample_weights
+    are stored in sparse records: sample weights outside them are always zero.
+
+    :param masks: the twelve monthly active cell masks
+    :param n_forecast_days:
+    :return:
+    """
+    masks = np.asarray(masks).reshape(len(masks), -1)
+    indexes = []
+
+    for month in range(1, 13):
+        # A leap year gives the longest reach of any forecast from February
+        start = pd.Timestamp(2000, month, 1)
+        reach = pd.date_range(start,
+                              start + pd.offsets.MonthEnd(0) +
+                              pd.Timedelta(days=n_forecast_days - 1))
+        active = masks[np.unique(reach.month) - 1].any(axis=0)
+        indexes.append(np.flatnonzero(active))
+
+    table = np.full((12, max([len(idx) for idx in indexes])), -1,
+                    dtype=np.int32)
+
+    for month_idx, idx in enumerate(indexes):
+        table[month_idx, :len(idx)] = idx
+    return table
+
+
 def write_tfrecord(writer: object,
                    x: object,
                    y: object,
-                   sample_weights: object):
+                   sample_weights: object,
+                   active_cells: object = None,
+                   month: int = None,
+                   output_dtype: str = None,
+                   record_version: int = RECORD_VERSION):
     """
 
     :param writer:
     :param x:
     :param y:
     :param sample_weights:
-    :param data_check:
+    :param active_cells: table from get_active_cell_indexes, to store only
+        the active cells of y and sample_weights
+    :param month: month of the forecast date, required with active_cells
+    :param output_dtype: storage for y and sample_weights, see OUTPUT_DTYPES
+    :param record_version: encoding to use, see RECORD_VERSION
     """
 
     # FIXME: this will trigger eager computation of the dataset, should be
@@ -41,13 +197,79 @@ def write_tfrecord(writer: object,
 
     #        if data_check and x_nans > 0:
 
-    record_data = tf.train.Example(features=tf.train.Features(feature={
-        "x": tf.train.Feature(
-            float_list=tf.train.FloatList(value=x.reshape(-1))),
-        "y": tf.train.Feature(
-            float_list=tf.train.FloatList(value=y.reshape(-1))),
-        "sample_weights": tf.train.Feature(
-            float_list=tf.train.FloatList(value=sample_weights.reshape(-1))),
-    })).SerializeToString()
+    if record_version < 2:
+        if output_dtype is not None or active_cells is not None:
+            raise RuntimeError("Version {} records cannot be stored as {}".
+                               format(record_version,
+                                      output_dtype or "sparse"))
+
+        record_data = tf.train.Example(features=tf.train.Features(feature={
+            "x": tf.train.Feature(
+                float_list=tf.train.FloatList(value=x.reshape(-1))),
+            "y": tf.train.Feature(
+                float_list=tf.train.FloatList(value=y.reshape(-1))),
+            "sample_weights": tf.train.Feature(
+                float_list=tf.train.FloatList(
+                    value=sample_weights.reshape(-1))),
+        })).SerializeToString()
+    else:
+        features = dict()
+        x, y, sample_weights = \
+            np.asarray(x), np.asarray(y), np.asarray(sample_weights)
+
+        if output_dtype == "float16":
+            y = y.astype(np.float16)
+            sample_weights = sample_weights.astype(np.float16)
+        elif output_dtype == "uint8":
+            # NaNs in y always have a zero sample weight
+            y = np.round(np.clip(np.nan_to_num(y), 0., 1.) * 255).\
+                astype(np.uint8)
+
+            sw_scale = sample_weights.max(axis=(0, 1))
+            sample_weights = np.round(
+                sample_weights / np.where(sw_scale > 0, sw_scale, 1.) * 255).\
+                astype(np.uint8)
+
+            features["sample_weights_scale"] = tf.train.Feature(
+                float_list=tf.train.FloatList(value=sw_scale.reshape(-1)))
+
+        if active_cells is not None:
+            cells = active_cells[month - 1]
+            cells = cells[cells >= 0]
+
+            y = y.reshape(-1, *y.shape[2:])[cells]
+            sample_weights = \
+                sample_weights.reshape(-1, *sample_weights.shape[2:])[cells]
+
+            features["active_month"] = tf.train.Feature(
+                int64_list=tf.train.Int64List(value=[month - 1]))
+
+        for name, data in (("x", x),
+                           ("y", y),
+                           ("sample_weights", sample_weights)):
+            features.update(raw_features(name, data))
+
+        record_data = tf.train.Example(features=tf.train.Features(
+            feature=features)).SerializeToString()
 
     writer.write(record_data)
+
+
+def raw_features(name: str,
+                 data: object) -> dict:
+    """Features storing the buffer of an array directly, with its header
+
+    :param name:
+    :param data:
+    :return:
+    """
+    data = np.ascontiguousarray(data)
+
+    return {
+        name: tf.train.Feature(
+            bytes_list=tf.train.BytesList(value=[data.tobytes()])),
+        "{}_shape".format(name): tf.train.Feature(
+            int64_list=tf.train.Int64List(value=data.shape)),
+        "{}_dtype".format(name): tf.train.Feature(
+            bytes_list=tf.train.BytesList(value=[data.dtype.name.encode()])),
+    }
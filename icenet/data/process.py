@@ -9,8 +9,9 @@ import pandas as pd
 import xarray as xr
 
 from icenet.data.producers import Processor
+from icenet.data.processors.utils import LinearTrendCache
 from icenet.data.sic.mask import Masks
-from icenet.model.models import linear_trend_forecast
+from icenet.model.models import linear_trend_forecasts
 
 """
 
@@ -27,6 +28,7 @@ class IceNetPreProcessor(Processor):
     :param val_dates:
     :param test_dates: 
     :param *args:
+    :param append: only process and append dates newer than those processed
     :param data_shape: 
     :param dtype:
     :param exclude_vars: 
@@ -42,11 +44,16 @@ class IceNetPreProcessor(Processor):
     :param parallel_opens:
     :param ref_procdir:
     :param source_data:
+    :param store: "netcdf" files or time chunked, compressed "zarr" stores
     :param update_key:
     :param update_loader: 
     """
 
     DATE_FORMAT = "%Y_%m_%d"
+    STORE_TYPES = {
+        "netcdf": "nc",
+        "zarr": "zarr",
+    }
 
     def __init__(self,
                  abs_vars,
@@ -60,6 +67,7 @@ class IceNetPreProcessor(Processor):
                  val_dates,
                  test_dates,
                  *args,
+                 append=False,
                  data_shape=(432, 432),
                  dtype=np.float32,
                  exclude_vars=(),
@@ -75,6 +83,7 @@ class IceNetPreProcessor(Processor):
                  parallel_opens=False,
                  ref_procdir=None,
                  source_data=os.path.join(".", "data"),
+                 store="netcdf",
                  update_key=None,
                  update_loader=True,
                  **kwargs):
@@ -89,6 +98,7 @@ class IceNetPreProcessor(Processor):
                          **kwargs)
 
         self._abs_vars = abs_vars if abs_vars else []
+        self._append = append
         self._anom_vars = anom_vars if anom_vars else []
         # TODO: Ugh, this should not be here any longer
         self._meta_vars = list(meta_vars)
@@ -105,6 +115,7 @@ class IceNetPreProcessor(Processor):
             if not minmax else self._normalise_array_scaling
         self._parallel = parallel_opens
         self._refdir = ref_procdir
+        self._store = store
         self._update_key = self.identifier if not update_key else update_key
         self._update_loader = os.path.join(".",
                                            "loader.{}.json".format(name)) \
@@ -117,6 +128,10 @@ class IceNetPreProcessor(Processor):
         else:
             self._linear_trend_steps = [int(el) for el in linear_trend_steps]
 
+        if self._store not in IceNetPreProcessor.STORE_TYPES:
+            raise RuntimeError("Store type {} is not one of {}".format(
+                self._store, ", ".join(IceNetPreProcessor.STORE_TYPES)))
+
     def process(self):
         """
 
@@ -184,6 +199,7 @@ class IceNetPreProcessor(Processor):
             "linear_trends":    self._linear_trends,
             "linear_trend_steps": self._linear_trend_steps,
             "meta":             self._meta_vars,
+            "store":            self._store,
             # TODO: intention should perhaps be to strip these from
             #  other date sets, this is just an indicative placeholder
             #  for the mo
@@ -228,6 +244,22 @@ class IceNetPreProcessor(Processor):
         with open(self._update_loader, "w") as fh:
             json.dump(configuration, fh, indent=4, default=_serialize)
 
+    def save_processed_file(self,
+                            var_name: str,
+                            name: str,
+                            data: object, **kwargs):
+        """Save to the configured store type, named for that store
+
+        :param var_name:
+        :param name:
+        :param data:
+        :param kwargs:
+        :return:
+        """
+        name = "{}.{}".format(os.path.splitext(name)[0],
+                              IceNetPreProcessor.STORE_TYPES[self._store])
+        return super().save_processed_file(var_name, name, data, **kwargs)
+
     def _save_variable(self, var_name: str, var_suffix: str):
         """
 
@@ -236,6 +268,31 @@ class IceNetPreProcessor(Processor):
         """
         with dask.config.set(**{'array.slicing.split_large_chunks': True}):
             da = self._open_dataarray_from_files(var_name)
+            processed_da = None
+            last_date = None
+
+            if self._append and self._can_append(var_name, var_suffix):
+                processed_da = self._open_processed_file(
+                    var_name, "{}_{}".format(var_name, var_suffix))
+                last_date = processed_da.time.values.max()
+
+                da = da.isel(time=da.time.values > last_date)
+                logging.info("Appending {} dates after {} to {}_{}".format(
+                    len(da.time), pd.to_datetime(last_date).date(),
+                    var_name, var_suffix))
+
+                if not len(da.time):
+                    processed_da.close()
+                    self._add_processed_file(
+                        var_name, self._get_processed_path(
+                            var_name, "{}_{}".format(var_name, var_suffix)))
+
+                    if var_name in self._linear_trends and \
+                            var_suffix == "abs":
+                        self._add_processed_file(
+                            var_name, self._get_processed_path(
+                                var_name, "{}_linear_trend".format(var_name)))
+                    return
 
             # FIXME: we should ideally store train dates against the
             #  normalisation and climatology, to ensure recalculation on
@@ -301,11 +358,25 @@ class IceNetPreProcessor(Processor):
                     logging.info("We have a reference {}, so will load "
                                  "and supply abs from that for linear trend of "
                                  "{}".format(self._refdir, var_name))
-                    ref_da = xr.open_dataarray(
-                        os.path.join(self._refdir, var_name,
-                                     "{}_{}.nc".format(var_name, var_suffix)))
+                    ref_path = os.path.join(
+                        self._refdir, var_name,
+                        "{}_{}.zarr".format(var_name, var_suffix))
+
+                    # The reference can have been processed to either store
+                    if os.path.exists(ref_path):
+                        ref_da = xr.open_dataarray(ref_path,
+                                                   consolidated=True,
+                                                   engine="zarr")
+                    else:
+                        ref_da = xr.open_dataarray(
+                            "{}.nc".format(os.path.splitext(ref_path)[0]))
+                elif processed_da is not None:
+                    # The stored abs values are unnormalised for the trend
+                    ref_da = xr.concat([processed_da, da], dim="time")
 
-                self._build_linear_trend_da(da, var_name, ref_da=ref_da)
+                self._build_linear_trend_da(da, var_name,
+                                            last_date=last_date,
+                                            ref_da=ref_da)
 
             elif var_name in self._linear_trends \
                     and var_name not in self._abs_vars:
@@ -321,10 +392,79 @@ class IceNetPreProcessor(Processor):
 
             da = self.post_normalisation(var_name, da)
 
+            if processed_da is not None:
+                processed_da.close()
+
             self.save_processed_file(var_name,
                                      "{}_{}.nc".format(var_name, var_suffix),
                                      da.rename(
-                                         "_".join([var_name, var_suffix])))
+                                         "_".join([var_name, var_suffix])),
+                                     append=processed_da is not None)
+
+    def _can_append(self, var_name: str, var_suffix: str) -> bool:
+        """Appending relies on already processed output and the stored
+        parameters that produced it
+
+        :param var_name:
+        :param var_suffix:
+        :return:
+        """
+        required = [self._get_processed_path(
+            var_name, "{}_{}".format(var_name, var_suffix))]
+
+        if var_name in self._anom_vars:
+            required.append(
+                os.path.join(self._refdir, "params",
+                             "climatology.{}".format(var_name))
+                if self._refdir else
+                os.path.join(self.get_data_var_folder("params"),
+                             "climatology.{}".format(var_name)))
+
+        if var_name not in self._no_normalise:
+            norm_dir = "normalisation.mean" \
+                if self._normalise == self._normalise_array_mean \
+                else "normalisation.scale"
+            required.append(
+                os.path.join(self._refdir, norm_dir, var_name)
+                if self._refdir else
+                os.path.join(self.get_data_var_folder(norm_dir), var_name))
+
+        if var_name in self._linear_trends and var_suffix == "abs":
+            if var_name not in self._no_normalise and not self._refdir:
+                logging.warning("Cannot append to {}, the linear trend needs "
+                                "unnormalised abs values".format(var_name))
+                return False
+
+        missing = [path for path in required if not os.path.exists(path)]
+
+        if len(missing):
+            logging.warning("Cannot append to {}_{}, processing all dates "
+                            "as {} do not exist".format(
+                                var_name, var_suffix, ", ".join(missing)))
+            return False
+        return True
+
+    def _get_processed_path(self, var_name: str, name: str) -> str:
+        """
+
+        :param var_name:
+        :param name: name of the output, without extension
+        :return:
+        """
+        return os.path.join(self.get_data_var_folder(var_name), "{}.{}".format(
+            name, IceNetPreProcessor.STORE_TYPES[self._store]))
+
+    def _open_processed_file(self, var_name: str, name: str) -> object:
+        """
+
+        :param var_name:
+        :param name: name of the output, without extension
+        :return:
+        """
+        return xr.open_dataarray(
+            self._get_processed_path(var_name, name),
+            **(dict(consolidated=True, engine="zarr")
+               if self._store == "zarr" else dict()))
 
     def _open_dataarray_from_files(self, var_name: str):
 
@@ -501,6 +641,7 @@ class IceNetPreProcessor(Processor):
     def _build_linear_trend_da(self,
                                input_da: object,
                                var_name: str,
+                               last_date: object = None,
                                max_years: int = 35,
                                ref_da: object = None):
         """
@@ -509,6 +650,8 @@ class IceNetPreProcessor(Processor):
 
         :param input_da:
         :param var_name:
+        :param last_date: the last date of already processed data, to only
+            produce trend dates after it and update the existing trend
         :param max_years:
         :param ref_da:
         :return:
@@ -530,62 +673,80 @@ class IceNetPreProcessor(Processor):
                  for d in self._linear_trend_steps])
 
         trend_dates = list(sorted(trend_dates))
+        trend_path = self._get_processed_path(
+            var_name, "{}_linear_trend".format(var_name))
+        append = last_date is not None and os.path.exists(trend_path)
+
+        if append:
+            # Stored trends past the previous data were fitted before the new
+            # data existed, so they are recomputed and overwritten
+            with self._open_processed_file(
+                    var_name, "{}_linear_trend".format(var_name)) as existing:
+                stale_dates = [pd.Timestamp(date)
+                               for date in existing.time.values
+                               if date > last_date]
+
+            trend_dates = list(sorted(set(trend_dates).union(stale_dates)))
+
         logging.info("Generating {} trend dates".format(len(trend_dates)))
 
         linear_trend_da = \
             xr.broadcast(input_da, xr.DataArray(pd.date_range(
-                data_dates[0],
-                data_dates[-1] + pd.DateOffset(days=trend_steps)),
+                min(data_dates[0], trend_dates[0]),
+                trend_dates[-1]),
                     dims="time"))[0]
         linear_trend_da = linear_trend_da.sel(time=trend_dates)
         linear_trend_da.data = np.zeros(linear_trend_da.shape)
 
         land_mask = Masks(north=self.north, south=self.south).get_land_mask()
 
-        # Could use shelve, but more likely we'll run into concurrency issues
-        # pickleshare might be an option but a little over-engineery
-        trend_cache_path = os.path.join(
-            self.get_data_var_folder(var_name),
-            "{}_linear_trend.nc".format(var_name)
-        )
-        trend_cache = linear_trend_da.copy()
-        trend_cache.data = np.full_like(linear_trend_da.data, np.nan)
-
-        if os.path.exists(trend_cache_path):
-            trend_cache = xr.open_dataarray(trend_cache_path)
-            logging.info("Loaded {} entries from {}".
-                         format(len(trend_cache.time), trend_cache_path))
-
-        def data_selector(da,
-                          processing_date,
-                          missing_dates=tuple()):
-            target_date = pd.to_datetime(processing_date)
-
-            date_da = da[(da.time['time.month'] == target_date.month) &
-                         (da.time['time.day'] == target_date.day) &
-                         (da.time <= target_date) &
-                         ~da.time.isin(missing_dates)].\
-                isel(time=slice(0, max_years))
-            return date_da
-
-        for forecast_date in sorted(trend_dates, reverse=True):
-            if not trend_cache.sel(time=forecast_date).isnull().all():
-                output_map = trend_cache.sel(time=forecast_date)
-            else:
-                output_map = linear_trend_forecast(
-                    data_selector, forecast_date, ref_da, land_mask,
-                    missing_dates=self._missing_dates,
-                    shape=self._data_shape)
-
-            linear_trend_da.loc[dict(time=forecast_date)] = output_map
+        trend_cache = LinearTrendCache(
+            os.path.join(self.get_data_var_folder(var_name),
+                         "{}_linear_trend_cache.zarr".format(var_name)),
+            "{}_linear_trend".format(var_name),
+            ref_da=ref_da,
+            settings=dict(hemisphere=self.hemisphere_str,
+                          linear_trend_steps=self._linear_trend_steps,
+                          max_years=max_years,
+                          missing_dates=sorted(
+                              pd.to_datetime(self._missing_dates).
+                              strftime("%Y-%m-%d")),
+                          ref_procdir=self._refdir,
+                          shape=list(self._data_shape)))
+
+        cached_dates, cached_maps = trend_cache.get(trend_dates)
+
+        if len(cached_dates):
+            linear_trend_da.loc[dict(time=cached_dates)] = cached_maps
+
+        compute_dates = pd.DatetimeIndex(
+            sorted(set(trend_dates).difference(cached_dates)))
+
+        if len(compute_dates):
+            output_maps = linear_trend_forecasts(
+                ref_da,
+                compute_dates,
+                land_mask,
+                max_years=max_years,
+                missing_dates=self._missing_dates,
+                shape=self._data_shape)
+            linear_trend_da.loc[dict(time=compute_dates)] = output_maps
+
+            # Trends for dates beyond the data can change as data arrives,
+            # as can those without any data yet, so only cache the others
+            final = (compute_dates <= ref_da.time.values.max()) & \
+                ~np.isnan(output_maps).all(axis=(1, 2))
+            trend_cache.put(linear_trend_da.sel(time=compute_dates[final]))
+
+        logging.info("Linear trend cache for {}: {} hits, {} misses".
+                     format(var_name, trend_cache.hits, trend_cache.misses))
 
-        logging.info("Writing new trend cache for {}".format(var_name))
-        trend_cache.close()
         linear_trend_da = linear_trend_da.rename(
             "{}_linear_trend".format(var_name))
         self.save_processed_file(var_name,
                                  "{}_linear_trend.nc".format(var_name),
-                                 linear_trend_da)
+                                 linear_trend_da,
+                                 append=append)
 
         return linear_trend_da
 
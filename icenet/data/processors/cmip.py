@@ -13,16 +13,21 @@ class IceNetCMIPPreProcessor(IceNetPreProcessor):
 
     :param source:
     :param member:
+    :param workers: processes to use for interpolating SIC
     """
     def __init__(self,
                  source: str,
                  member: str,
-                 *args, **kwargs):
+                 *args,
+                 workers: int = 1,
+                 **kwargs):
         cmip_source = "{}.{}".format(source, member)
         super().__init__(*args,
                          identifier="cmip6.{}".format(cmip_source),
                          **kwargs)
 
+        self._workers = workers
+
     def pre_normalisation(self,
                           var_name: str,
                           da: object):
@@ -34,7 +39,7 @@ class IceNetCMIPPreProcessor(IceNetPreProcessor):
         """
         if var_name == "siconca":
             masks = Masks(north=self.north, south=self.south)
-            return sic_interpolate(da, masks)
+            return sic_interpolate(da, masks, workers=self._workers)
 
         return da
 
@@ -44,6 +49,8 @@ def main():
         extra_args=[
             (["source"], dict(type=str)),
             (["member"], dict(type=str)),
+            (["-w", "--workers"], dict(default=1, type=int,
+                                       help="Processes for interpolation")),
         ],
     )
     dates = process_date_args(args)
@@ -57,12 +64,14 @@ def main():
         dates["train"],
         dates["val"],
         dates["test"],
+        append=args.append,
         linear_trends=args.trends,
         linear_trend_days=args.trend_lead,
         north=args.hemisphere == "north",
         parallel_opens=args.parallel_opens,
         ref_procdir=args.ref,
         south=args.hemisphere == "south",
+        store=args.store,
         update_key=args.update_key,
     )
     cmip.init_source_data(
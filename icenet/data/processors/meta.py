@@ -123,5 +123,6 @@ def main():
     IceNetMetaPreProcessor(
         args.name,
         north=args.hemisphere == "north",
-        south=args.hemisphere == "south"
+        south=args.hemisphere == "south",
+        store=args.store,
     ).process()
@@ -25,12 +25,14 @@ def main():
         dates["train"],
         dates["val"],
         dates["test"],
+        append=args.append,
         linear_trends=args.trends,
         linear_trend_days=args.trend_lead,
         north=args.hemisphere == "north",
         parallel_opens=args.parallel_opens,
         ref_procdir=args.ref,
         south=args.hemisphere == "south",
+        store=args.store,
         update_key=args.update_key,
     )
     oras5.init_source_data(
@@ -15,12 +15,16 @@ class IceNetOSIPreProcessor(IceNetPreProcessor):
     """
 
     :param missing_dates:
+    :param workers: processes to use for interpolating SIC
     """
     def __init__(self, *args,
                  missing_dates: object = None,
+                 workers: int = 1,
                  **kwargs):
         super().__init__(*args, identifier="osisaf", **kwargs)
 
+        self._workers = workers
+
         missing_dates_path = os.path.join(
             self._source_data,
             "siconca",
@@ -49,11 +53,16 @@ class IceNetOSIPreProcessor(IceNetPreProcessor):
                                "with siconca, ")
         else:
             masks = Masks(north=self.north, south=self.south)
-            return sic_interpolate(da, masks)
+            return sic_interpolate(da, masks, workers=self._workers)
 
 
 def main():
-    args = process_args()
+    args = process_args(
+        extra_args=[
+            (["-w", "--workers"], dict(default=1, type=int,
+                                       help="Processes for interpolation")),
+        ],
+    )
     dates = process_date_args(args)
 
     osi = IceNetOSIPreProcessor(
@@ -63,12 +72,15 @@ def main():
         dates["train"],
         dates["val"],
         dates["test"],
+        append=args.append,
         linear_trends=args.trends,
         linear_trend_steps=args.trend_lead,
         north=args.hemisphere == "north",
         parallel_opens=args.parallel_opens,
         ref_procdir=args.ref,
-        south=args.hemisphere == "south"
+        south=args.hemisphere == "south",
+        store=args.store,
+        workers=args.workers,
     )
     osi.init_source_data(
         lag_days=args.lag,
@@ -1,5 +1,9 @@
 import argparse
+import contextlib
+import fcntl
 import glob
+import hashlib
+import json
 import logging
 import os
 
@@ -10,7 +14,9 @@ import xarray as xr
 from icenet.utils import Hemisphere
 from icenet.data.producers import DataProducer
 
-from scipy import interpolate
+from concurrent.futures import ProcessPoolExecutor
+
+from scipy.spatial import Delaunay
 from scipy.spatial.qhull import QhullError
 
 """
@@ -19,22 +25,29 @@ from scipy.spatial.qhull import QhullError
 
 
 def sic_interpolate(da: object,
-                    masks: object) -> object:
-    """
+                    masks: object,
+                    workers: int = 1) -> object:
+    """Interpolate over the polar hole and NaN regions of each day
+
+    The triangulation and interpolation weights depend only on which cells
+    are invalid, so days are grouped by their invalid cells and each
+    distinct pattern is triangulated once, then applied to all of its days.
 
-    :param da:
+    :param da: numpy backed data, interpolated in place
     :param masks:
+    :param workers: processes to interpolate distinct patterns with
     :return:
     """
-    for date in da.time.values:
+    data = np.moveaxis(da.data, da.get_axis_num("time"), 0)
+    dates = da.time.values
+    patterns = dict()
+
+    for idx, date in enumerate(dates):
         polarhole_mask = masks.get_polarhole_mask(
             pd.to_datetime(date).date())
 
-        da_day = da.sel(time=date)
-        xx, yy = np.meshgrid(np.arange(432), np.arange(432))
-
         # Grid cells outside of polar hole or NaN regions
-        valid = ~np.isnan(da_day.data)
+        valid = ~np.isnan(data[idx])
 
         # Interpolate polar hole
         if type(polarhole_mask) is np.ndarray:
@@ -42,66 +55,263 @@ def sic_interpolate(da: object,
 
         # Interpolate if there is more than one missing grid cell
         if np.sum(~valid) >= 1:
-            # Find grid cell locations surrounding NaN regions for bilinear
-            # interpolation
-            nan_mask = np.ma.masked_array(np.full((432, 432), 0.))
-            nan_mask[~valid] = np.ma.masked
-
-            nan_neighbour_arrs = {}
-            for order in 'C', 'F':
-                # starts and ends indexes of masked element chunks
-                slice_ends = np.ma.clump_masked(nan_mask.ravel(order=order))
-
-                nan_neighbour_idxs = []
-                nan_neighbour_idxs.extend([s.start for s in slice_ends])
-                nan_neighbour_idxs.extend([s.stop - 1 for s in slice_ends])
-
-                nan_neighbour_arr_i = np.array(np.full((432, 432), False),
-                                               order=order)
-                nan_neighbour_arr_i.ravel(order=order)[nan_neighbour_idxs] \
-                    = True
-                nan_neighbour_arrs[order] = nan_neighbour_arr_i
-
-            nan_neighbour_arr = nan_neighbour_arrs['C'] + \
-                nan_neighbour_arrs['F']
-            # Remove artefacts along edge of the grid
-            nan_neighbour_arr[:, 0] = \
-                nan_neighbour_arr[0, :] = \
-                nan_neighbour_arr[:, -1] = \
-                nan_neighbour_arr[-1, :] = False
-
-            if np.sum(nan_neighbour_arr) == 1:
-                res = np.where(np.array(nan_neighbour_arr) == True)
-                logging.warning("Not enough nans for interpolation, extending {}".format(res))
-                x_idx, y_idx = res[0][0], res[1][0]
-                nan_neighbour_arr[x_idx-1:x_idx+2, y_idx] = True
-                nan_neighbour_arr[x_idx, y_idx-1:y_idx+2] = True
-                logging.debug(np.where(np.array(nan_neighbour_arr) == True))
-
-            # Perform bilinear interpolation
-            x_valid = xx[nan_neighbour_arr]
-            y_valid = yy[nan_neighbour_arr]
-            values = da_day.data[nan_neighbour_arr]
-
-            x_interp = xx[~valid]
-            y_interp = yy[~valid]
+            key = np.packbits(~valid).tobytes()
 
-            try:
-                if len(x_valid) or len(y_valid):
-                    interp_vals = interpolate.griddata((x_valid, y_valid),
-                                                       values,
-                                                       (x_interp, y_interp),
-                                                       method='linear')
-                    da.sel(time=date).data[~valid] = interp_vals
-                else:
-                    logging.warning("No valid values to interpolate with on "
-                                    "{}".format(date))
-            except QhullError:
-                logging.exception("Geometrical degeneracy from QHull, interpolation failed")
+            if key not in patterns:
+                patterns[key] = (~valid, [])
+            patterns[key][1].append(idx)
+
+    logging.info("Interpolating {} days with {} distinct invalid patterns".
+                 format(sum([len(el[1]) for el in patterns.values()]),
+                        len(patterns)))
+
+    tasks = [(invalid, data[idxs], dates[idxs])
+             for invalid, idxs in patterns.values()]
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_interpolate_pattern, *zip(*tasks)))
+    else:
+        results = [_interpolate_pattern(*task) for task in tasks]
+
+    for (invalid, idxs), interp_vals in zip(patterns.values(), results):
+        if interp_vals is not None:
+            data[np.array(idxs)[:, np.newaxis], invalid] = interp_vals
 
     return da
 
 
+def _interpolate_pattern(invalid: object,
+                         days: object,
+                         dates: object) -> object:
+    """Bilinear interpolation of the invalid cells for a stack of days
+
+    :param invalid: mask of cells to interpolate
+    :param days: array of (day, yc, xc) data
+    :param dates: dates of the days, for logging
+    :return: array of (day, invalid cell) values, or None on failure
+    """
+    shape = invalid.shape
+    xx, yy = np.meshgrid(np.arange(shape[1]), np.arange(shape[0]))
+
+    # Find grid cell locations surrounding NaN regions for bilinear
+    # interpolation
+    nan_mask = np.ma.masked_array(np.full(shape, 0.))
+    nan_mask[invalid] = np.ma.masked
+
+    nan_neighbour_arrs = {}
+    for order in 'C', 'F':
+        # starts and ends indexes of masked element chunks
+        slice_ends = np.ma.clump_masked(nan_mask.ravel(order=order))
+
+        nan_neighbour_idxs = []
+        nan_neighbour_idxs.extend([s.start for s in slice_ends])
+        nan_neighbour_idxs.extend([s.stop - 1 for s in slice_ends])
+
+        nan_neighbour_arr_i = np.array(np.full(shape, False), order=order)
+        nan_neighbour_arr_i.ravel(order=order)[nan_neighbour_idxs] = True
+        nan_neighbour_arrs[order] = nan_neighbour_arr_i
+
+    nan_neighbour_arr = nan_neighbour_arrs['C'] + nan_neighbour_arrs['F']
+    # Remove artefacts along edge of the grid
+    nan_neighbour_arr[:, 0] = \
+        nan_neighbour_arr[0, :] = \
+        nan_neighbour_arr[:, -1] = \
+        nan_neighbour_arr[-1, :] = False
+
+    if np.sum(nan_neighbour_arr) == 1:
+        res = np.where(np.array(nan_neighbour_arr) == True)
+        logging.warning("Not enough nans for interpolation, extending {}".format(res))
+        x_idx, y_idx = res[0][0], res[1][0]
+        nan_neighbour_arr[x_idx-1:x_idx+2, y_idx] = True
+        nan_neighbour_arr[x_idx, y_idx-1:y_idx+2] = True
+        logging.debug(np.where(np.array(nan_neighbour_arr) == True))
+
+    x_valid = xx[nan_neighbour_arr]
+    y_valid = yy[nan_neighbour_arr]
+
+    if not (len(x_valid) or len(y_valid)):
+        logging.warning("No valid values to interpolate with on {}".
+                        format(", ".join([str(d) for d in dates])))
+        return None
+
+    # Equivalent to griddata linear interpolation, but with the Delaunay
+    # triangulation and barycentric weights computed once for every day
+    try:
+        tri = Delaunay(np.c_[x_valid, y_valid])
+    except QhullError:
+        logging.exception("Geometrical degeneracy from QHull, interpolation "
+                          "failed for {}".format(
+                              ", ".join([str(d) for d in dates])))
+        return None
+
+    points = np.c_[xx[invalid], yy[invalid]].astype(np.float64)
+    simplices = tri.find_simplex(points)
+    transform = tri.transform[simplices]
+
+    weights = np.einsum("nij,nj->ni",
+                        transform[:, :2, :],
+                        points - transform[:, 2, :])
+    weights = np.c_[weights, 1 - weights.sum(axis=1)]
+    vertices = tri.simplices[simplices]
+
+    values = days[:, nan_neighbour_arr].astype(np.float64)
+    interp_vals = np.einsum("dnk,nk->dn", values[:, vertices], weights)
+    interp_vals[:, simplices == -1] = np.nan
+    return interp_vals
+
+
+class LinearTrendCache:
+    """Persistent store of linear trend maps keyed by date
+
+    Maps are appended to a Zarr store as they're computed. Reads and appends
+    take a lock on an adjacent lock file, so concurrent preprocessors can
+    share the store, and appends skip dates another process has written in
+    the meantime.
+
+    The store records a hash of the settings, and of the reference data up to
+    the last date its maps were fitted to. A store that doesn't match is
+    ignored, and replaced on the next append, so that changing how the trend
+    is produced never reuses stale maps.
+
+    :param path: path of the Zarr store
+    :param var_name: name of the trend variable in the store
+    :param ref_da: the data the trend is fitted to
+    :param settings: anything else that determines the trend, JSON encodable
+    """
+
+    def __init__(self,
+                 path: str,
+                 var_name: str,
+                 ref_da: object = None,
+                 settings: dict = None):
+        self._path = path
+        self._lock_path = "{}.lock".format(path)
+        self._ref_da = ref_da
+        self._var_name = var_name
+
+        self._data_hashes = dict()
+        self._settings_hash = hashlib.sha1(json.dumps(
+            settings if settings else dict(),
+            default=str,
+            sort_keys=True).encode()).hexdigest()
+
+        self._hits = 0
+        self._misses = 0
+
+    @contextlib.contextmanager
+    def _lock(self, exclusive: bool = False):
+        """
+
+        :param exclusive:
+        """
+        with open(self._lock_path, "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _data_hash(self, end: object) -> str:
+        """Hashes the reference data up to end, a year at a time
+
+        :param end: last date of the data to hash
+        :return:
+        """
+        end = pd.Timestamp(end)
+
+        if end not in self._data_hashes:
+            sha = hashlib.sha1()
+
+            if self._ref_da is not None:
+                da = self._ref_da.sel(time=slice(None, end))
+                sha.update(np.asarray(da.time.values).tobytes())
+
+                for idx in range(0, len(da.time), 366):
+                    sha.update(np.ascontiguousarray(
+                        da.isel(time=slice(idx, idx + 366)).values).tobytes())
+            self._data_hashes[end] = sha.hexdigest()
+        return self._data_hashes[end]
+
+    def _valid(self, ds: object) -> bool:
+        """
+
+        :param ds: the opened store
+        :return: whether the store was produced from the same inputs
+        """
+        if ds.attrs.get("settings_hash") != self._settings_hash \
+                or "data_end" not in ds.attrs:
+            return False
+        return ds.attrs.get("data_hash") == \
+            self._data_hash(ds.attrs["data_end"])
+
+    def get(self, dates: object) -> tuple:
+        """
+
+        :param dates:
+        :return: the dates found in the cache and an array of their maps
+        """
+        dates = pd.DatetimeIndex(dates)
+        found, maps = dates[:0], None
+
+        if os.path.exists(self._path):
+            with self._lock():
+                with xr.open_zarr(self._path, consolidated=True) as ds:
+                    if not self._valid(ds):
+                        logging.info("Ignoring {}, the linear trend inputs "
+                                     "have changed".format(self._path))
+                    else:
+                        found = dates[dates.isin(ds.indexes["time"])]
+
+                        if len(found):
+                            maps = ds[self._var_name].sel(time=found).values
+
+        self._hits += len(found)
+        self._misses += len(dates) - len(found)
+        return found, maps
+
+    def put(self, da: object):
+        """
+
+        :param da: maps to add to the cache, with a time dimension
+        """
+        with self._lock(exclusive=True):
+            kwargs = dict(mode="w")
+
+            if os.path.exists(self._path):
+                with xr.open_zarr(self._path, consolidated=True) as ds:
+                    valid = self._valid(ds)
+                    cached = ds.indexes["time"]
+
+                if valid:
+                    da = da.isel(time=~da.indexes["time"].isin(cached))
+                    kwargs = dict(append_dim="time")
+                else:
+                    logging.info("Replacing {}, the linear trend inputs have "
+                                 "changed".format(self._path))
+
+            if len(da.time):
+                logging.debug("Caching {} trend maps in {}".
+                              format(len(da.time), self._path))
+                data_end = pd.Timestamp(
+                    self._ref_da.time.values.max()
+                    if self._ref_da is not None else da.time.values.max())
+
+                ds = da.to_dataset(name=self._var_name).chunk(dict(time=1))
+                ds.attrs = dict(data_end=data_end.isoformat(),
+                                data_hash=self._data_hash(data_end),
+                                settings_hash=self._settings_hash)
+                ds.to_zarr(self._path, consolidated=True, **kwargs)
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+
 def condense_main():
     ap = argparse.ArgumentParser()
     ap.add_argument("identifier")
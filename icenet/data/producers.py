@@ -7,8 +7,11 @@ import logging
 import os
 import re
 
+import numpy as np
 import pandas as pd
+import xarray as xr
 
+from icenet.data.interfaces.utils import append_netcdf
 from icenet.utils import Hemisphere, HemisphereMixin
 
 
@@ -299,19 +302,82 @@ class Processor(DataProducer):
     def save_processed_file(self,
                             var_name: str,
                             name: str,
-                            data: object, **kwargs):
+                            data: object,
+                            append: bool = False,
+                            **kwargs):
         """
 
         :param var_name:
         :param name:
         :param data:
+        :param append: append data along time to an existing file, which
+            for NetCDF has to be a DataArray
         :param kwargs:
         :return:
         """
         file_path = os.path.join(
             self.get_data_var_folder(var_name, **kwargs), name)
-        data.to_netcdf(file_path)
+        append = append and os.path.exists(file_path)
+
+        if file_path.endswith(".zarr"):
+            if type(data) is xr.DataArray:
+                data = data.to_dataset(
+                    name=data.name if data.name else var_name)
+
+            # Single day chunks match the reads made when generating samples,
+            # each is compressed with the default zarr (blosc) compressor
+            if "time" in data.dims:
+                data = data.chunk(dict(time=1))
+
+            if append:
+                with xr.open_zarr(file_path, consolidated=True) as existing:
+                    store_times = existing.time.values
+
+                exists = np.isin(data.time.values, store_times)
+
+                if exists.any():
+                    # Dates already stored are overwritten in place, which
+                    # needs them to be a run at the end of the store
+                    region = np.flatnonzero(
+                        np.isin(store_times, data.time.values[exists]))
+
+                    if region[0] + len(region) != len(store_times) \
+                            or len(region) != exists.sum():
+                        raise RuntimeError("Cannot overwrite dates in {} "
+                                           "that are not at the end of the "
+                                           "store".format(file_path))
+
+                    data.isel(time=exists).\
+                        drop_vars([name for name in data.variables
+                                   if "time" not in data[name].dims]).\
+                        to_zarr(file_path,
+                                region=dict(time=slice(int(region[0]),
+                                                       len(store_times))))
+
+                if not exists.all():
+                    data.isel(time=~exists).\
+                        to_zarr(file_path, append_dim="time",
+                                consolidated=True)
+            else:
+                data.to_zarr(file_path, consolidated=True, mode="w")
+        elif append:
+            # Only the new dates are written, along the unlimited time
+            # dimension of the existing file
+            append_netcdf(data, file_path)
+        else:
+            data.to_netcdf(file_path,
+                           unlimited_dims=["time"]
+                           if "time" in data.dims else None)
 
+        self._add_processed_file(var_name, file_path)
+        return file_path
+
+    def _add_processed_file(self, var_name: str, file_path: str):
+        """
+
+        :param var_name:
+        :param file_path:
+        """
         if var_name not in self._processed_files.keys():
             self._processed_files[var_name] = list()
 
@@ -321,7 +387,6 @@ class Processor(DataProducer):
         else:
             logging.warning("{} already exists in {} processed list".
                             format(file_path, var_name))
-        return file_path
 
     @property
     def dates(self):
@@ -0,0 +1,236 @@
+import collections
+import contextlib
+import ftplib
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+"""
+Pooled FTP connections, for downloading many files concurrently from a
+single server
+"""
+
+# Errors after which the transfer is worth trying again on a new connection
+TRANSIENT_FTP_ERRORS = (ftplib.error_temp,
+                        ftplib.error_reply,
+                        EOFError,
+                        OSError,
+                        socket.timeout)
+
+
+class FTPPool:
+    """Bounded pool of FTP connections with cached listings and resumable
+    transfers
+
+    Directory listings are persisted to cache_path, and refreshed at most
+    once per directory over the lifetime of the pool. Files are transferred
+    to a .part file, resumed from its size on retry, and renamed once
+    complete.
+
+    :param host:
+    :param cache_path: JSON file to persist directory listings to
+    :param connections: maximum number of simultaneous connections
+    :param passwd:
+    :param port:
+    :param retries: further attempts to make for each failed transfer
+    :param retry_delay: seconds to wait between attempts
+    :param timeout:
+    :param user:
+    """
+
+    def __init__(self,
+                 host: str,
+                 cache_path: str = None,
+                 connections: int = 4,
+                 passwd: str = "",
+                 port: int = 21,
+                 retries: int = 3,
+                 retry_delay: float = 1.,
+                 timeout: int = 60,
+                 user: str = ""):
+        self._cache_path = cache_path
+        self._host = host
+        self._passwd = passwd
+        self._port = port
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._timeout = timeout
+        self._user = user
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(connections)
+
+        self._listings = dict()
+        self._listing_locks = collections.defaultdict(threading.Lock)
+        self._refreshed = set()
+
+        if self._cache_path and os.path.exists(self._cache_path):
+            with open(self._cache_path, "r") as fh:
+                self._listings = json.load(fh)
+            logging.debug("Loaded {} FTP listings from {}".
+                          format(len(self._listings), self._cache_path))
+
+        self._stats = dict(bytes=0, files=0, retries=0, seconds=0.)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _connect(self) -> object:
+        """
+
+        :return: a logged in ftplib.FTP
+        """
+        ftp = ftplib.FTP(timeout=self._timeout)
+        ftp.connect(self._host, self._port)
+        ftp.login(self._user, self._passwd)
+        return ftp
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection, which is discarded if an error occurs
+
+        """
+        with self._slots:
+            try:
+                ftp = self._idle.get_nowait()
+            except queue.Empty:
+                logging.debug("FTP opening to {}".format(self._host))
+                ftp = self._connect()
+
+            try:
+                yield ftp
+            except Exception:
+                ftp.close()
+                raise
+            else:
+                self._idle.put(ftp)
+
+    def close(self):
+        """Close all idle connections
+
+        """
+        while True:
+            try:
+                ftp = self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                ftp.quit()
+            except TRANSIENT_FTP_ERRORS:
+                ftp.close()
+
+    def _retry(self,
+               description: str,
+               method: callable,
+               *args, **kwargs):
+        """Calls method with a connection, retrying after transient errors
+
+        :param description: for logging
+        :param method: called with the connection, then args and kwargs
+        :return: what method returns
+        """
+        for attempt in range(self._retries + 1):
+            try:
+                with self.connection() as ftp:
+                    return method(ftp, *args, **kwargs)
+            except ftplib.error_perm:
+                raise
+            except TRANSIENT_FTP_ERRORS as e:
+                if attempt == self._retries:
+                    raise
+
+                logging.warning("FTP failure {}, retrying: {}".
+                                format(description, e))
+                with self._lock:
+                    self._stats["retries"] += 1
+                time.sleep(self._retry_delay)
+
+    def nlst(self,
+             path: str,
+             refresh: bool = False) -> list:
+        """Lists a directory, from the cache unless refreshing
+
+        Each directory is listed once, however many threads ask for it
+
+        :param path:
+        :param refresh: list again, if not already listed by this pool
+        :return: list of filenames
+        """
+        with self._lock:
+            listing_lock = self._listing_locks[path]
+
+        # Threads wanting the same directory wait for a single listing
+        with listing_lock:
+            with self._lock:
+                if path in self._listings and \
+                        (not refresh or path in self._refreshed):
+                    return self._listings[path]
+
+            listing = self._retry("listing {}".format(path),
+                                  lambda ftp: ftp.nlst(path))
+            listing = [os.path.basename(filename) for filename in listing]
+
+            with self._lock:
+                self._listings[path] = listing
+                self._refreshed.add(path)
+
+                if self._cache_path:
+                    temp_path = "{}.{}.tmp".format(self._cache_path,
+                                                   os.getpid())
+
+                    with open(temp_path, "w") as fh:
+                        json.dump(self._listings, fh)
+                    os.replace(temp_path, self._cache_path)
+            return listing
+
+    def retrieve(self,
+                 path: str,
+                 destination: str):
+        """Downloads a file, resuming any partial transfer
+
+        :param path: of the file on the server
+        :param destination:
+        """
+        part_path = "{}.part".format(destination)
+        start = time.time()
+
+        def _transfer(ftp: object) -> int:
+            offset = os.path.getsize(part_path) \
+                if os.path.exists(part_path) else 0
+
+            if offset > 0:
+                logging.debug("Resuming {} from {} bytes".
+                              format(path, offset))
+
+            with open(part_path, "ab") as fh:
+                fh.truncate(offset)
+                ftp.retrbinary("RETR {}".format(path),
+                               fh.write,
+                               rest=offset if offset > 0 else None)
+            return os.path.getsize(part_path) - offset
+
+        transferred = self._retry("retrieving {}".format(path), _transfer)
+        os.replace(part_path, destination)
+
+        with self._lock:
+            self._stats["bytes"] += transferred
+            self._stats["files"] += 1
+            self._stats["seconds"] += time.time() - start
+
+    @property
+    def stats(self) -> dict:
+        """Bytes and files transferred, retries and transfer seconds
+
+        Seconds are summed over the transfers, which can be concurrent
+        """
+        with self._lock:
+            return dict(self._stats)
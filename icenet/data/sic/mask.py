@@ -3,6 +3,7 @@ import logging
 import os
 import shutil
 
+import dask.array
 import numpy as np
 import pandas as pd
 import xarray as xr
@@ -27,6 +28,9 @@ class Masks(Generator):
     """
 
     LAND_MASK_FILENAME = "land_mask.npy"
+    # Process-wide cache of memory-mapped mask files, keyed by path, shared
+    # between instances as the masks are read in per-date loops
+    _mask_cache = dict()
     # FIXME: nh/sh?
     POLARHOLE_RADII = (28, 11, 3)
     POLARHOLE_DATES = (
@@ -138,6 +142,10 @@ class Masks(Generator):
                                      format(month))
             logging.info("Saving {}".format(mask_path))
 
+            for path in (mask_path, os.path.join(
+                    self.get_data_var_folder("masks"),
+                    "active_grid_cell_masks")):
+                Masks._mask_cache.pop(path, None)
             np.save(mask_path, max_extent_mask)
 
             land_mask_path = os.path.join(self.get_data_var_folder("masks"),
@@ -150,6 +158,7 @@ class Masks(Generator):
                                 reshape(*self._shape) >= 1
 
                 logging.info("Saving {}".format(land_mask_path))
+                Masks._mask_cache.pop(land_mask_path, None)
                 np.save(land_mask_path, land_mask)
 
         # Delete the data/siconca/2000 folder holding the temporary daily files
@@ -175,8 +184,30 @@ class Masks(Generator):
                                               "polarhole{}_mask.npy".
                                               format(i+1))
                 logging.info("Saving polarhole {}".format(polarhole_path))
+                Masks._mask_cache.pop(polarhole_path, None)
                 np.save(polarhole_path, polarhole)
 
+    def _load_mask(self,
+                   filename: str,
+                   error: str = None) -> object:
+        """Memory-mapped, read only mask from the process-wide cache
+
+        :param filename:
+        :param error: message to raise if the mask has not been generated
+        :return:
+        """
+        mask_path = os.path.join(self.get_data_var_folder("masks"), filename)
+
+        if mask_path not in Masks._mask_cache:
+            if not os.path.exists(mask_path):
+                raise RuntimeError(error if error is not None else
+                                   "{} has not been generated".
+                                   format(mask_path))
+
+            logging.debug("Loading mask {}".format(mask_path))
+            Masks._mask_cache[mask_path] = np.load(mask_path, mmap_mode="r")
+        return Masks._mask_cache[mask_path]
+
     def get_active_cell_mask(self,
                              month: object) -> object:
         """
@@ -184,17 +215,32 @@ class Masks(Generator):
         :param month:
         :return:
         """
-        mask_path = os.path.join(self.get_data_var_folder("masks"),
-                                 "active_grid_cell_mask_{:02d}.npy".
-                                 format(month))
+        return self._load_mask(
+            "active_grid_cell_mask_{:02d}.npy".format(month),
+            "Active cell masks have not been generated, this is not done "
+            "automatically so you might want to address this!")[self._region]
 
-        if not os.path.exists(mask_path):
-            raise RuntimeError("Active cell masks have not been generated, "
-                               "this is not done automatically so you might "
-                               "want to address this!")
+    def get_active_cell_masks(self) -> object:
+        """The twelve monthly active cell masks as a single array
 
-        # logging.debug("Loading active cell mask {}".format(mask_path))
-        return np.load(mask_path)[self._region]
+        :return: read only array of shape (12, *shape), indexed by month - 1
+        """
+        stack_key = os.path.join(self.get_data_var_folder("masks"),
+                                 "active_grid_cell_masks")
+
+        if stack_key not in Masks._mask_cache:
+            region, self._region = self._region, \
+                (slice(None, None), slice(None, None))
+            try:
+                stack = np.stack([self.get_active_cell_mask(month)
+                                  for month in range(1, 13)])
+            finally:
+                self._region = region
+
+            stack.flags.writeable = False
+            Masks._mask_cache[stack_key] = stack
+        return Masks._mask_cache[stack_key][(slice(None),) +
+                                            tuple(self._region)]
 
     def get_active_cell_da(self,
                            src_da: object) -> object:
@@ -202,10 +248,10 @@ class Masks(Generator):
 
         :param src_da:
         """
+        month_idx = pd.DatetimeIndex(src_da.time.values).month.values - 1
 
         return xr.DataArray(
-            [self.get_active_cell_mask(pd.to_datetime(date).month)
-             for date in src_da.time.values],
+            self.get_active_cell_masks()[month_idx],
             dims=('time', 'yc', 'xc'),
             coords={
                 'time': src_da.time.values,
@@ -214,6 +260,25 @@ class Masks(Generator):
             }
         )
 
+    def get_active_cell_cube(self) -> object:
+        """Active cell masks indexed by month rather than time
+
+        Select with a month index, e.g. ``cube.sel(month=da.time.dt.month)``,
+        to broadcast the masks over time lazily: each month is a single chunk
+        so no per time copy is made until the selection is computed.
+
+        :return: xarray.DataArray with dims (month, yc, xc)
+        """
+        masks = self.get_active_cell_masks()
+
+        return xr.DataArray(
+            dask.array.from_array(masks, chunks=(1, *masks.shape[1:])),
+            dims=('month', 'yc', 'xc'),
+            coords={
+                'month': np.arange(1, 13),
+            }
+        )
+
     def get_land_mask(self,
                       land_mask_filename: str = LAND_MASK_FILENAME) -> object:
         """
@@ -221,16 +286,10 @@ class Masks(Generator):
         :param land_mask_filename:
         :return:
         """
-        mask_path = os.path.join(self.get_data_var_folder("masks"),
-                                 land_mask_filename)
-
-        if not os.path.exists(mask_path):
-            raise RuntimeError("Land mask has not been generated, this is "
-                               "not done automatically so you might want to "
-                               "address this!")
-
-        # logging.debug("Loading land mask {}".format(mask_path))
-        return np.load(mask_path)[self._region]
+        return self._load_mask(
+            land_mask_filename,
+            "Land mask has not been generated, this is not done "
+            "automatically so you might want to address this!")[self._region]
 
     def get_polarhole_mask(self,
                            date: object) -> object:
@@ -244,11 +303,8 @@ class Masks(Generator):
 
         for i, r in enumerate(self._polarhole_radii):
             if date <= self._polarhole_dates[i]:
-                polarhole_path = os.path.join(self.get_data_var_folder("masks"),
-                                              "polarhole{}_mask.npy".
-                                              format(i + 1))
-                # logging.debug("Loading polarhole {}".format(polarhole_path))
-                return np.load(polarhole_path)[self._region]
+                return self._load_mask(
+                    "polarhole{}_mask.npy".format(i + 1))[self._region]
         return None
 
     def get_blank_mask(self) -> object:
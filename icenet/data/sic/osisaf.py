@@ -3,9 +3,10 @@ import fnmatch
 import ftplib
 import logging
 import os
+import time
 
 import datetime as dt
-from ftplib import FTP
+from concurrent.futures import ThreadPoolExecutor
 
 import dask
 from distributed import Client, LocalCluster
@@ -14,7 +15,9 @@ import pandas as pd
 import xarray as xr
 
 from icenet.data.cli import download_args
+from icenet.data.interfaces.utils import append_netcdf
 from icenet.data.producers import Downloader
+from icenet.data.sic.ftp import FTPPool
 from icenet.data.sic.mask import Masks
 from icenet.utils import Hemisphere, run_command
 from icenet.data.sic.utils import SIC_HEMI_STR
@@ -273,6 +276,7 @@ class SICDownloader(Downloader):
     :param delete_tempfiles:
     :param download:
     :param dtype:
+    :param ftp_connections: simultaneous FTP connections to download with
     """
     def __init__(self,
                  *args,
@@ -282,6 +286,7 @@ class SICDownloader(Downloader):
                  delete_tempfiles: bool = True,
                  download: bool = True,
                  dtype: object = np.float32,
+                 ftp_connections: int = 4,
                  parallel_opens: bool = True,
                  **kwargs):
         super().__init__(*args, identifier="osisaf", **kwargs)
@@ -291,6 +296,7 @@ class SICDownloader(Downloader):
         self._delete = delete_tempfiles
         self._download = download
         self._dtype = dtype
+        self._ftp_connections = ftp_connections
         self._parallel_opens = parallel_opens
         self._invalid_dates = invalid_sic_days[self.hemisphere] + \
             list(additional_invalid_dates)
@@ -310,7 +316,7 @@ class SICDownloader(Downloader):
         """
         hs = SIC_HEMI_STR[self.hemisphere_str[0]]
         data_files = []
-        ftp = None
+        downloads = []
         var = "siconca"
 
         logging.info(
@@ -318,9 +324,6 @@ class SICDownloader(Downloader):
             "existence already" if not self._download else
             "Downloading SIC datafiles to .temp intermediates...")
 
-        cache = {}
-        osi430b_start = dt.date(2016, 1, 1)
-
         dt_arr = list(reversed(sorted(copy.copy(self._dates))))
 
         # Filtering dates based on existing data
@@ -389,46 +392,12 @@ class SICDownloader(Downloader):
                         data_files.append(temp_path)
                     continue
 
-                if not ftp:
-                    logging.info("FTP opening")
-                    ftp = FTP('osisaf.met.no')
-                    ftp.login()
-
-                chdir_path = self._ftp_osi450 \
-                    if el < osi430b_start else self._ftp_osi430b
-                chdir_path = chdir_path.format(el.year, el.month)
-
-                try:
-                    ftp.cwd(chdir_path)
-
-                    if chdir_path not in cache:
-                        cache[chdir_path] = ftp.nlst()
-
-                    cache_match = "ice_conc_{}_ease*_{:04d}{:02d}{:02d}*.nc".\
-                        format(hs, el.year, el.month, el.day)
-                    ftp_files = [el for el in cache[chdir_path]
-                                 if fnmatch.fnmatch(el, cache_match)]
-
-                    if len(ftp_files) > 1:
-                        raise ValueError("More than a single file found: {}".
-                                         format(ftp_files))
-                    elif not len(ftp_files):
-                        logging.warning("File is not available: {}".
-                                        format(cache_match))
-                        continue
-                except ftplib.error_perm:
-                    logging.warning("FTP error, possibly missing month chdir "
-                                    "for {}".format(date_str))
-                    continue
-
-                with open(temp_path, "wb") as fh:
-                    ftp.retrbinary("RETR {}".format(ftp_files[0]), fh.write)
+                downloads.append((el, temp_path))
 
-                logging.debug("Downloaded {}".format(temp_path))
-                data_files.append(temp_path)
-
-        if ftp:
-            ftp.quit()
+        if len(downloads):
+            data_files += [df for df in self._ftp_download(downloads, hs)
+                           if df is not None]
+            data_files = sorted(data_files, key=os.path.basename)
 
         logging.debug("Files being processed: {}".format(data_files))
 
@@ -478,24 +447,19 @@ class SICDownloader(Downloader):
 
                 year_path = os.path.join(
                     var_folder, "{}.nc".format(getattr(req_date, "year")))
-                old_year_path = os.path.join(
-                    var_folder, "old.{}.nc".format(getattr(req_date, "year")))
 
                 if os.path.exists(year_path):
-                    logging.info("Existing file needs concatenating: {} -> {}".
-                                 format(year_path, old_year_path))
-                    os.rename(year_path, old_year_path)
-                    old_da = xr.open_dataarray(old_year_path)
-                    year_da = year_da.drop_sel(time=old_da.time,
-                                               errors="ignore")
-                    year_da = xr.concat([old_da, year_da],
-                                        dim="time").sortby("time")
-                    old_da.close()
-                    os.unlink(old_year_path)
-
-                logging.info("Saving {}".format(year_path))
-                year_da.compute()
-                year_da.to_netcdf(year_path)
+                    logging.info("Existing file needs merging: {}".
+                                 format(year_path))
+
+                    # Data already in the file takes precedence
+                    with xr.open_dataset(year_path) as old_ds:
+                        year_da = year_da.drop_sel(time=old_ds.time,
+                                                   errors="ignore")
+
+                if len(year_da.time) > 0:
+                    year_da.load()
+                    append_netcdf(year_da, year_path)
 
         self.missing_dates()
 
@@ -503,6 +467,84 @@ class SICDownloader(Downloader):
             for fpath in data_files:
                 os.unlink(fpath)
 
+    def _ftp_download(self,
+                      downloads: list,
+                      hs: str) -> list:
+        """Downloads daily files concurrently over pooled FTP connections
+
+        :param downloads: list of tuples of date and path to download to
+        :param hs:
+        :return: list of downloaded paths, None where not available
+        """
+        start = time.time()
+        logging.info("Downloading {} SIC files over {} FTP connections".
+                     format(len(downloads), self._ftp_connections))
+
+        with FTPPool("osisaf.met.no",
+                     cache_path=os.path.join(self.base_path,
+                                             "ftp_listing.json"),
+                     connections=self._ftp_connections) as pool, \
+                ThreadPoolExecutor(max_workers=self._ftp_connections) \
+                as executor:
+            futures = [executor.submit(self._ftp_download_date,
+                                       pool, el, temp_path, hs)
+                       for el, temp_path in downloads]
+            data_files = [future.result() for future in futures]
+
+        stats = pool.stats
+        duration = time.time() - start
+        logging.info("Downloaded {} files, {:.1f}MB in {:.1f}s ({:.2f}MB/s), "
+                     "with {} retries".format(
+                         stats["files"], stats["bytes"] / 1e6, duration,
+                         stats["bytes"] / 1e6 / max(duration, 1e-6),
+                         stats["retries"]))
+        return data_files
+
+    def _ftp_download_date(self,
+                           pool: object,
+                           el: object,
+                           temp_path: str,
+                           hs: str) -> object:
+        """
+
+        :param pool: FTPPool
+        :param el: date to download
+        :param temp_path:
+        :param hs:
+        :return: temp_path, or None if not available
+        """
+        date_str = el.strftime("%Y_%m_%d")
+        ftp_path = self._ftp_osi450 \
+            if el < dt.date(2016, 1, 1) else self._ftp_osi430b
+        ftp_path = ftp_path.format(el.year, el.month)
+
+        cache_match = "ice_conc_{}_ease*_{:04d}{:02d}{:02d}*.nc".\
+            format(hs, el.year, el.month, el.day)
+
+        try:
+            ftp_files = fnmatch.filter(pool.nlst(ftp_path), cache_match)
+
+            if not len(ftp_files):
+                # The cached listing might predate the file
+                ftp_files = fnmatch.filter(pool.nlst(ftp_path, refresh=True),
+                                           cache_match)
+        except ftplib.error_perm:
+            logging.warning("FTP error, possibly missing month directory "
+                            "for {}".format(date_str))
+            return None
+
+        if len(ftp_files) > 1:
+            raise ValueError("More than a single file found: {}".
+                             format(ftp_files))
+        elif not len(ftp_files):
+            logging.warning("File is not available: {}".
+                            format(cache_match))
+            return None
+
+        pool.retrieve("{}{}".format(ftp_path, ftp_files[0]), temp_path)
+        logging.debug("Downloaded {}".format(temp_path))
+        return temp_path
+
     def missing_dates(self):
         """
 
@@ -537,16 +579,12 @@ class SICDownloader(Downloader):
             da = xr.concat([da, da_1979_01_01], dim='time')
             da = da.sortby('time')
 
-        dates_obs = [pd.to_datetime(date).date() for date in da.time.values]
-        dates_all = [pd.to_datetime(date).date() for date in
-                     pd.date_range(min(self._dates), max(self._dates))]
+        dates_obs = pd.to_datetime(da.time.values).normalize()
+        dates_all = pd.date_range(min(self._dates), max(self._dates))
 
-        # Weirdly, we were getting future warnings for timestamps, but unsure
-        # where from
-        invalid_dates = [pd.to_datetime(d).date() for d in self._invalid_dates]
-        missing_dates = [date for date in dates_all
-                         if date not in dates_obs
-                         or date in invalid_dates]
+        invalid_dates = pd.to_datetime(self._invalid_dates).normalize()
+        missing_dates = dates_all.difference(dates_obs).union(
+            dates_all.intersection(invalid_dates))
 
         logging.info("Processing {} missing dates".format(len(missing_dates)))
 
@@ -554,40 +592,44 @@ class SICDownloader(Downloader):
             self.get_data_var_folder("siconca"), "missing_days.csv")
 
         with open(missing_dates_path, "a") as fh:
-            for date in missing_dates:
-                # FIXME: slightly unusual format for Ymd dates
-                fh.write(date.strftime("%Y,%m,%d\n"))
+            # FIXME: slightly unusual format for Ymd dates
+            fh.writelines(missing_dates.strftime("%Y,%m,%d\n"))
 
+        interp_dates = missing_dates.difference(dates_obs)
         logging.debug("Interpolating {} missing dates".
-                      format(len(missing_dates)))
-
-        for date in missing_dates:
-            if pd.Timestamp(date) not in da.time.values:
-                logging.info("Interpolating {}".format(date))
-                da = xr.concat([da,
-                                da.interp(time=pd.to_datetime(date))],
-                               dim='time')
+                      format(len(interp_dates)))
 
-        logging.debug("Finished interpolation")
-
-        da = da.sortby('time')
+        if len(interp_dates):
+            # Interpolated between the observations either side, so cells
+            # that are NaN in either remain NaN
+            da = xr.concat([da, da.interp(time=interp_dates)], dim="time").\
+                sortby("time")
         da.data = np.array(da.data, dtype=self._dtype)
 
-        for date in missing_dates:
-            date_str = pd.to_datetime(date).strftime("%Y_%m_%d")
-            fpath = os.path.join(
-                self.get_data_var_folder(
-                    "siconca", append=[str(pd.to_datetime(date).year)]),
-                "missing.{}.nc".format(date_str))
-
-            if not os.path.exists(fpath):
-                day_da = da.sel(time=slice(date, date))
-                mask = self._mask_dict[pd.to_datetime(date).month]
-
-                day_da.data[0][~mask] = 0.
+        logging.debug("Finished interpolation")
 
-                logging.info("Writing missing date file {}".format(fpath))
-                day_da.to_netcdf(fpath)
+        fpaths = [os.path.join(
+            self.get_data_var_folder("siconca", append=[str(date.year)]),
+            "missing.{}.nc".format(date.strftime("%Y_%m_%d")))
+            for date in missing_dates]
+        write_dates = [date for date, fpath in zip(missing_dates, fpaths)
+                       if not os.path.exists(fpath)]
+        fpaths = [fpath for fpath in fpaths if not os.path.exists(fpath)]
+
+        if len(write_dates):
+            day_das = da.sel(time=write_dates)
+            masks = np.stack([self._mask_dict[date.month]
+                              for date in write_dates])
+            day_das = day_das.where(
+                xr.DataArray(masks, dims=day_das.dims,
+                             coords=dict(time=day_das.time)), 0.)
+            da.loc[dict(time=write_dates)] = day_das
+
+            logging.info("Writing {} missing date files".format(len(fpaths)))
+            xr.save_mfdataset([day_das.isel(time=slice(idx, idx + 1)).
+                               to_dataset()
+                               for idx in range(len(write_dates))],
+                              fpaths)
 
         return da
 
@@ -639,7 +681,9 @@ def main():
                             (("-dt", "--dask-timeouts"),
                              dict(type=int, default=120)),
                             (("-dp", "--dask-port"),
-                             dict(type=int, default=8888))
+                             dict(type=int, default=8888)),
+                            (("-fc", "--ftp-connections"),
+                             dict(type=int, default=4))
                          ])
 
     logging.info("OSASIF-SIC Data Downloading")
@@ -648,6 +692,7 @@ def main():
         dates=[pd.to_datetime(date).date() for date in
                pd.date_range(args.start_date, args.end_date, freq="D")],
         delete_tempfiles=args.delete,
+        ftp_connections=args.ftp_connections,
         north=args.hemisphere == "north",
         south=args.hemisphere == "south",
         parallel_opens=args.parallel_opens,
@@ -1,10 +1,13 @@
+import hashlib
 import logging
 import requests
 
 import cartopy.crs as ccrs
 import cf_units
 import iris
+import iris.analysis
 import numpy as np
+import scipy.sparse
 
 
 def assign_lat_lon_coord_system(cube: object):
@@ -28,15 +31,180 @@ def assign_lat_lon_coord_system(cube: object):
     return cube
 
 
+def _xy_dim_coords(cube: object) -> tuple:
+    """
+
+    :param cube:
+    :return: tuple of the x and y dimension coordinates
+    """
+    return cube.coord(axis="x", dim_coords=True), \
+        cube.coord(axis="y", dim_coords=True)
+
+
+def _linear_indexes(points: object,
+                    values: object,
+                    modulus: float = None,
+                    circular: bool = False) -> tuple:
+    """Bracketing indexes and weights to linearly interpolate values on points
+
+    Follows iris' linear scheme: points outside the coordinate are linearly
+    extrapolated from the two nearest, circular coordinates wrap around and
+    values of coordinates with a modulus are mapped into their range.
+
+    :param points: monotonic coordinate points
+    :param values:
+    :param modulus:
+    :param circular:
+    :return: tuple of lower indexes, upper indexes and upper weights
+    """
+    order = np.arange(len(points))
+
+    if len(points) > 1 and points[0] > points[1]:
+        points, order = points[::-1], order[::-1]
+
+    if circular:
+        points = np.append(points, points[0] + modulus)
+        order = np.append(order, order[0])
+
+    values = np.asarray(values, dtype=np.float64)
+
+    if modulus:
+        offset = (points.max() + points.min() - modulus) * 0.5
+        values = ((values - offset) % modulus) + offset
+
+    idx = np.clip(np.searchsorted(points, values) - 1, 0, len(points) - 2)
+    weights = (values - points[idx]) / (points[idx + 1] - points[idx])
+    return order[idx], order[idx + 1], weights
+
+
+def regrid_weights(cube: object,
+                   grid_cube: object) -> object:
+    """Sparse bilinear weights from the horizontal grid of cube to grid_cube
+
+    Multiplying the flattened (y, x) source fields by these weights matches
+    iris' Linear regridding scheme, with linear extrapolation.
+
+    :param cube: source cube with a rectilinear grid
+    :param grid_cube: cube with the target grid
+    :return: scipy.sparse.csr_matrix of shape (target cells, source cells)
+    """
+    src_x, src_y = _xy_dim_coords(cube)
+    grid_x, grid_y = _xy_dim_coords(grid_cube)
+
+    # Target cell centres in the coordinate system of the source
+    sample_x, sample_y = np.meshgrid(grid_x.points, grid_y.points)
+    pts = src_x.coord_system.as_cartopy_crs().transform_points(
+        grid_x.coord_system.as_cartopy_crs(),
+        sample_x.ravel().astype(np.float64),
+        sample_y.ravel().astype(np.float64))
+
+    x0, x1, wx = _linear_indexes(src_x.points, pts[:, 0],
+                                 modulus=src_x.units.modulus,
+                                 circular=src_x.circular)
+    y0, y1, wy = _linear_indexes(src_y.points, pts[:, 1])
+
+    n_src_x = len(src_x.points)
+    rows = np.repeat(np.arange(len(pts)), 4)
+    cols = np.stack([y0 * n_src_x + x0, y0 * n_src_x + x1,
+                     y1 * n_src_x + x0, y1 * n_src_x + x1], axis=1).ravel()
+    weights = np.stack([(1 - wy) * (1 - wx), (1 - wy) * wx,
+                        wy * (1 - wx), wy * wx], axis=1).ravel()
+
+    return scipy.sparse.csr_matrix(
+        (weights, (rows, cols)),
+        shape=(len(pts), n_src_x * len(src_y.points)))
+
+
+def regrid_weights_key(cube: object,
+                       grid_cube: object) -> str:
+    """Identifies a pair of source and target grids, to cache weights against
+
+    :param cube:
+    :param grid_cube:
+    :return:
+    """
+    key = hashlib.sha1()
+
+    for grid in (cube, grid_cube):
+        for coord in _xy_dim_coords(grid):
+            key.update(np.ascontiguousarray(coord.points,
+                                            dtype=np.float64).tobytes())
+            key.update("{}|{}|{}".format(coord.units,
+                                         coord.circular,
+                                         coord.coord_system).encode())
+    return key.hexdigest()
+
+
+def regrid_with_weights(cube: object,
+                        grid_cube: object,
+                        weights: object,
+                        chunk_size: int = 32) -> object:
+    """Regrid cube onto the grid of grid_cube with precomputed weights
+
+    The metadata and coordinates of the result come from a lazy iris regrid,
+    which is never computed, and the data from multiplying each horizontal
+    field by the sparse weights.
+
+    :param cube:
+    :param grid_cube:
+    :param weights: from regrid_weights
+    :param chunk_size: number of horizontal fields to multiply at a time
+    :return: the regridded cube
+    """
+    result = cube.copy(cube.lazy_data()).regrid(grid_cube,
+                                                iris.analysis.Linear())
+
+    src_x, src_y = _xy_dim_coords(cube)
+    dims = (cube.coord_dims(src_y)[0], cube.coord_dims(src_x)[0])
+    grid_shape = tuple(len(coord.points)
+                       for coord in _xy_dim_coords(grid_cube)[::-1])
+
+    src_data = cube.data
+    masked = np.ma.isMaskedArray(src_data)
+    dtype = np.promote_types(src_data.dtype, np.float16) \
+        if src_data.dtype.kind == "i" else src_data.dtype
+
+    fields = np.moveaxis(np.ma.getdata(src_data), dims, (-2, -1))
+    other_shape = fields.shape[:-2]
+    fields = fields.reshape(-1, weights.shape[1])
+    src_mask = np.moveaxis(np.ma.getmaskarray(src_data), dims, (-2, -1)).\
+        reshape(fields.shape) if masked else None
+
+    data = np.empty((len(fields), weights.shape[0]), dtype=dtype)
+    mask = np.zeros(data.shape, dtype=bool) if masked else None
+
+    for idx in range(0, len(fields), chunk_size):
+        chunk = slice(idx, idx + chunk_size)
+        src_fields = fields[chunk]
+
+        if masked:
+            # As with iris, cells that masked values contribute to are masked
+            mask[chunk] = (weights @ src_mask[chunk].T.astype(
+                np.float64)).T > 0
+        data[chunk] = (weights @ src_fields.T.astype(np.float64)).T
+
+    data = np.moveaxis(data.reshape(*other_shape, *grid_shape),
+                       (-2, -1), dims)
+
+    if masked:
+        data = np.ma.MaskedArray(
+            data,
+            mask=np.moveaxis(mask.reshape(*other_shape, *grid_shape),
+                             (-2, -1), dims))
+
+    result.data = data
+    return result
+
+
 def rotate_grid_vectors(u_cube: object,
                         v_cube: object,
                         angles: object):
     """
     Author: Tony Phillips (BAS)
 
-    Wrapper for :func:`~iris.analysis.cartography.rotate_grid_vectors`
-    that can rotate multiple masked spatial fields in one go by iterating
-    over the horizontal spatial axes in slices
+    Equivalent of :func:`~iris.analysis.cartography.rotate_grid_vectors`
+    that can rotate multiple masked spatial fields in one go, broadcasting
+    the angles over the other axes of the whole array
 
     :param u_cube:
     :param v_cube:
@@ -44,25 +212,32 @@ def rotate_grid_vectors(u_cube: object,
     :return:
 
     """
-    # lists to hold slices of rotated vectors
-    u_r_all = iris.cube.CubeList()
-    v_r_all = iris.cube.CubeList()
-
-    # get the X and Y dimension coordinates for each source cube
-    u_xy_coords = [u_cube.coord(axis='x', dim_coords=True),
-                   u_cube.coord(axis='y', dim_coords=True)]
-    v_xy_coords = [v_cube.coord(axis='x', dim_coords=True),
-                   v_cube.coord(axis='y', dim_coords=True)]
-
-    # iterate over X, Y slices of the source cubes, rotating each in turn
-    for u, v in zip(u_cube.slices(u_xy_coords, ordered=False),
-                    v_cube.slices(v_xy_coords, ordered=False)):
-        u_r, v_r = iris.analysis.cartography.rotate_grid_vectors(u, v, angles)
-        u_r_all.append(u_r)
-        v_r_all.append(v_r)
-
-    # return the slices, merged back together into a pair of cubes
-    return u_r_all.merge_cube(), v_r_all.merge_cube()
+    u_out, v_out = u_cube.copy(), v_cube.copy()
+
+    angles = angles.copy()
+    angles.convert_units("radians")
+
+    # Move the horizontal axes of the source cubes to the end, so the
+    # angles broadcast against them
+    dims = [u_cube.coord_dims(u_cube.coord(axis=axis, dim_coords=True))[0]
+            for axis in ("y", "x")]
+    uu, vv = (np.moveaxis(cube.data, dims, (-2, -1))
+              for cube in (u_cube, v_cube))
+    aa = angles.data
+
+    mags = np.sqrt(uu * uu + vv * vv)
+    angs = np.arctan2(vv, uu) + aa
+
+    # Mask bad (NaN) angles, as well as masked values in either component
+    mask = np.isnan(aa) | np.ma.getmaskarray(uu) | np.ma.getmaskarray(vv)
+
+    u_out.data = np.moveaxis(np.ma.masked_array(mags * np.cos(angs),
+                                                mask=mask),
+                             (-2, -1), dims)
+    v_out.data = np.moveaxis(np.ma.masked_array(mags * np.sin(angs),
+                                                mask=mask),
+                             (-2, -1), dims)
+    return u_out, v_out
 
 
 def gridcell_angles_from_dim_coords(cube: object):
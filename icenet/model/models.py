@@ -1,4 +1,5 @@
 import numpy as np
+import pandas as pd
 import tensorflow as tf
 from tensorflow.keras.models import Model
 from tensorflow.keras.layers import Conv2D, BatchNormalization, UpSampling2D, \
@@ -192,3 +193,71 @@ def linear_trend_forecast(usable_selector: object,
     output_map[output_map > 1] = 1.
 
     return output_map
+
+
+def linear_trend_forecasts(da: object,
+                           forecast_dates: object,
+                           mask: object,
+                           max_years: int = 35,
+                           missing_dates: object = (),
+                           shape: object = (432, 432)) -> object:
+    """Vectorised linear_trend_forecast for many forecast dates at once
+
+    Each forecast fits the same day of year over the earliest `max_years`
+    usable years up to the forecast date, so forecasts for a day of year
+    differ only in how many of those years they use. Every fit for the day is
+    therefore solved in closed form from cumulative sums over the years, for
+    all pixels at once, rather than by a least squares solve per date.
+
+    :param da: time ordered data to fit, with time as the first dimension
+    :param forecast_dates:
+    :param mask:
+    :param max_years:
+    :param missing_dates:
+    :param shape:
+    :return: array of shape (forecast date, *shape)
+    """
+    forecast_dates = pd.DatetimeIndex(forecast_dates)
+    data_dates = pd.DatetimeIndex(da.time.values)
+    usable = ~da.time.isin(missing_dates).values
+
+    forecast_days = forecast_dates.month * 100 + forecast_dates.day
+    data_days = data_dates.month * 100 + data_dates.day
+
+    output = np.full((len(forecast_dates), *shape), np.nan)
+
+    for day in np.unique(forecast_days):
+        forecast_idx = np.flatnonzero(forecast_days == day)
+        data_idx = np.flatnonzero((data_days == day) & usable)
+
+        # Number of usable years for each forecast of this day
+        n = np.minimum(
+            np.searchsorted(data_dates[data_idx],
+                            forecast_dates[forecast_idx], side="right"),
+            max_years)
+
+        if n.max() < 1:
+            continue
+
+        y = np.asarray(da.isel(time=data_idx[:n.max()]).data,
+                       dtype=np.float64).reshape(n.max(), -1)
+        x = np.arange(n.max())[:, np.newaxis]
+        years = x + 1
+
+        # Fitting x = 0..n - 1 and predicting at x = n, the prediction is
+        # mean(y) + slope * (n + 1) / 2. A single year gives zero slope, as
+        # with the minimum norm least squares solution
+        sum_y = np.cumsum(y, axis=0)
+        sum_xy = np.cumsum(x * y, axis=0)
+        sxx = years * (years ** 2 - 1) / 12
+        slope = (sum_xy - sum_y * x / 2) / np.where(sxx > 0, sxx, 1)
+        predictions = sum_y / years + slope * (years + 1) / 2
+
+        fitted = n > 0
+        output_maps = predictions[n[fitted] - 1].reshape(-1, *shape)
+        output_maps[:, mask] = 0.
+        output_maps[output_maps < 0] = 0.
+        output_maps[output_maps > 1] = 1.
+        output[forecast_idx[fitted]] = output_maps
+
+    return output
@@ -1,8 +1,13 @@
 import argparse
+import collections
 import datetime as dt
 import logging
 import os
+import queue
 import re
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
@@ -22,29 +27,36 @@ from icenet.utils import setup_logging
 def predict_forecast(
     dataset_config: object,
     network_name: object,
+    batch_size: int = 1,
     dataset_name: object = None,
+    ensemble_folder: object = None,
     model_func: callable = models.unet_batchnorm,
     n_filters_factor: float = 1 / 8,
     network_folder: object = None,
     output_folder: object = None,
     save_args: bool = False,
-    seed: int = 42,
+    seed: object = 42,
     start_dates: object = tuple([dt.datetime.now().date()]),
     test_set: bool = False,
+    workers: int = 1,
 ) -> object:
     """
 
     :param dataset_config:
     :param network_name:
+    :param batch_size: number of dates to predict in each network call
     :param dataset_name:
+    :param ensemble_folder: folder for the ensemble mean and standard
+        deviation of each date, written directly when predicting many seeds
     :param model_func:
     :param n_filters_factor:
     :param network_folder:
-    :param output_folder:
+    :param output_folder: folder, or list of folders for each seed
     :param save_args:
-    :param seed:
+    :param seed: seed, or list of seeds, of the network(s) to run
     :param start_dates:
     :param test_set:
+    :param workers: threads generating input samples
     :return:
     """
     # TODO: going to need to be able to handle merged datasets
@@ -55,32 +67,46 @@ def predict_forecast(
         network_folder = os.path.join(".", "results", "networks", network_name)
 
     dataset_name = dataset_name if dataset_name else ds.identifier
-    network_path = os.path.join(network_folder,
-                                "{}.network_{}.{}.h5".format(network_name,
-                                                             dataset_name,
-                                                             seed))
-
-    logging.info("Loading model from {}...".format(network_path))
-
-    network = model_func(
-        (*ds.shape, dl.num_channels),
-        [],
-        [],
-        n_filters_factor=n_filters_factor,
-        n_forecast_days=ds.n_forecast_days
-    )
-    network.load_weights(network_path)
+    seeds = [seed] if type(seed) is int else list(seed)
+    output_folders = [output_folder] if type(output_folder) is str \
+        else list(output_folder)
+
+    if len(output_folders) != len(seeds):
+        raise RuntimeError("{} output folders given for {} seeds".
+                           format(len(output_folders), len(seeds)))
+
+    networks = []
+
+    # Each ensemble member is loaded once and run on every input sample
+    for member_seed in seeds:
+        network_path = os.path.join(network_folder,
+                                    "{}.network_{}.{}.h5".format(network_name,
+                                                                 dataset_name,
+                                                                 member_seed))
+
+        logging.info("Loading model from {}...".format(network_path))
+
+        network = model_func(
+            (*ds.shape, dl.num_channels),
+            [],
+            [],
+            n_filters_factor=n_filters_factor,
+            n_forecast_days=ds.n_forecast_days
+        )
+        network.load_weights(network_path)
+        networks.append(network)
 
     if not test_set:
         logging.info("Generating forecast inputs from processed/ files")
 
-        for date in start_dates:
-            data_sample = dl.generate_sample(date, prediction=True)
-            run_prediction(network=network,
-                           date=date,
-                           output_folder=output_folder,
-                           data_sample=data_sample,
-                           save_args=save_args)
+        run_batch_predictions(networks=networks,
+                              data_loader=dl,
+                              dates=start_dates,
+                              output_folders=output_folders,
+                              batch_size=batch_size,
+                              ensemble_folder=ensemble_folder,
+                              save_args=save_args,
+                              workers=workers)
     else:
         # TODO: This is horrible behaviour, rethink and refactor: we should
         #  be able to pull from the test set in a nicer and more efficient
@@ -117,13 +143,21 @@ def predict_forecast(
             logging.info("Processing test batch {}, item {} (date {})".format(
                 batch + 1, arr_idx, test_dates[idx]))
 
-            run_prediction(network=network,
-                           date=test_dates[idx],
-                           output_folder=output_folder,
-                           data_sample=(x[arr_idx, ...],
-                                        y[arr_idx, ...],
-                                        sw[arr_idx, ...]),
-                           save_args=save_args)
+            data_sample = (x[arr_idx, ...], y[arr_idx, ...], sw[arr_idx, ...])
+            preds = []
+
+            for network, member_folder in zip(networks, output_folders):
+                output_path = run_prediction(network=network,
+                                             date=test_dates[idx],
+                                             output_folder=member_folder,
+                                             data_sample=data_sample,
+                                             save_args=save_args)
+                if ensemble_folder:
+                    preds.append(np.load(output_path))
+
+            if ensemble_folder:
+                save_ensemble_prediction(test_dates[idx], preds,
+                                         ensemble_folder, output_folders)
 
 
 def run_prediction(network,
@@ -136,6 +170,189 @@ def run_prediction(network,
     logging.info("Running prediction {}".format(date))
     pred = network(tf.convert_to_tensor([net_input]), training=False)
 
+    return save_prediction(date, pred, output_folder, data_sample, save_args)
+
+
+def run_batch_predictions(networks: object,
+                          data_loader: object,
+                          dates: object,
+                          output_folders: object,
+                          batch_size: int = 1,
+                          ensemble_folder: str = None,
+                          save_args: bool = False,
+                          workers: int = 1) -> list:
+    """Predict dates in batches, generating their samples concurrently
+
+    Samples for the next batch are generated by a pool of threads while the
+    current batch is predicted, and outputs are saved by a background writer
+    thread, so the network is not held up by either. Every ensemble member
+    is run on each batch, so samples are only generated once.
+
+    :param networks: network, or list of ensemble member networks
+    :param data_loader:
+    :param dates:
+    :param output_folders: folder, or list of folders for each member
+    :param batch_size: number of dates to predict in each network call
+    :param ensemble_folder: folder to save ensemble mean and stddev to
+    :param save_args:
+    :param workers: threads generating input samples
+    :return: output paths, in the order they were saved
+    """
+    networks = networks if type(networks) is list else [networks]
+    output_folders = [output_folders] if type(output_folders) is str \
+        else output_folders
+
+    output_paths = []
+    write_errors = []
+    write_queue = queue.Queue(maxsize=batch_size * 2 * (len(networks) + 1))
+
+    def writer():
+        while True:
+            item = write_queue.get()
+
+            if item is None:
+                break
+
+            save_func, save_args_ = item
+            try:
+                output_paths.append(save_func(*save_args_))
+            except Exception as e:
+                logging.exception("Failed to save prediction {}".
+                                  format(save_args_[0]))
+                write_errors.append(e)
+
+    write_thread = threading.Thread(target=writer, daemon=True)
+    write_thread.start()
+
+    date_iter = iter(dates)
+    pending = collections.deque()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def submit_samples():
+                # Keep up to two batches generating ahead of the network
+                while len(pending) < batch_size * 2:
+                    try:
+                        date = next(date_iter)
+                    except StopIteration:
+                        break
+                    pending.append((date, executor.submit(
+                        data_loader.generate_sample, date, prediction=True)))
+
+            submit_samples()
+
+            while len(pending) > 0:
+                batch = [pending.popleft()
+                         for _ in range(min(batch_size, len(pending)))]
+                submit_samples()
+
+                batch_dates = [date for date, _ in batch]
+                samples = [future.result() for _, future in batch]
+                net_inputs = np.stack([net_input
+                                       for net_input, _, _ in samples])
+
+                logging.info("Running prediction for {} dates with {} "
+                             "networks: {}".format(
+                                len(batch_dates), len(networks),
+                                ", ".join([str(date)
+                                           for date in batch_dates])))
+                preds = [network.predict(net_inputs,
+                                         batch_size=len(samples),
+                                         verbose=0)
+                         for network in networks]
+
+                for i, date in enumerate(batch_dates):
+                    for pred, output_folder in zip(preds, output_folders):
+                        write_queue.put((save_prediction,
+                                         (date, pred[i:i + 1], output_folder,
+                                          samples[i], save_args)))
+
+                    if ensemble_folder:
+                        write_queue.put((save_ensemble_prediction,
+                                         (date, [pred[i:i + 1]
+                                                 for pred in preds],
+                                          ensemble_folder, output_folders)))
+    finally:
+        write_queue.put(None)
+        write_thread.join()
+
+    if len(write_errors) > 0:
+        raise RuntimeError("{} predictions could not be saved: {}".
+                           format(len(write_errors), write_errors[0]))
+    return output_paths
+
+
+def get_ensemble_stats(preds: object) -> object:
+    """Mean and standard deviation over ensemble member predictions
+
+    Welford's online algorithm is used so that members can be streamed, for
+    example as memory-mapped files, rather than held in memory together.
+
+    :param preds: iterable of member predictions for a single date
+    :return: array of mean and stddev, stacked on the last axis
+    """
+    n, mean, m2, dtype = 0, None, None, None
+
+    for pred in preds:
+        pred = np.asarray(pred)
+        n += 1
+
+        if mean is None:
+            dtype = pred.dtype
+            mean = pred.astype(np.float64)
+            m2 = np.zeros_like(mean)
+        else:
+            delta = pred - mean
+            mean += delta / n
+            m2 += delta * (pred - mean)
+
+    if n == 0:
+        raise RuntimeError("No ensemble members to aggregate")
+
+    return np.stack(
+        [mean, np.sqrt(m2 / n)],
+        axis=-1).squeeze().astype(dtype)
+
+
+def save_ensemble_prediction(date: object,
+                             preds: object,
+                             ensemble_folder: str,
+                             member_folders: object) -> str:
+    """Save the ensemble mean and stddev with the members they cover
+
+    :param date:
+    :param preds: member predictions for the date
+    :param ensemble_folder:
+    :param member_folders: output folders of the members, in order of preds
+    :return:
+    """
+    os.makedirs(ensemble_folder, exist_ok=True)
+    output_path = os.path.join(ensemble_folder, date.strftime("%Y_%m_%d.npz"))
+    stats = get_ensemble_stats(preds)
+
+    logging.info("Saving {} - ensemble of {} {}".
+                 format(date, len(preds), stats.shape))
+    np.savez(output_path,
+             members=np.array([os.path.basename(os.path.normpath(folder))
+                               for folder in member_folders]),
+             stats=stats)
+    return output_path
+
+
+def save_prediction(date: object,
+                    pred: object,
+                    output_folder: str,
+                    data_sample: tuple,
+                    save_args: bool) -> str:
+    """
+
+    :param date:
+    :param pred:
+    :param output_folder:
+    :param data_sample:
+    :param save_args:
+    :return:
+    """
     if os.path.exists(output_folder):
         logging.warning("{} output already exists".format(output_folder))
     os.makedirs(output_folder, exist_ok=output_folder)
@@ -161,6 +378,15 @@ def date_arg(string: str) -> object:
     return dt.date(*[int(s) for s in date_match.groups()])
 
 
+def seeds_arg(string: str) -> list:
+    """
+
+    :param string:
+    :return:
+    """
+    return [int(s) for s in string.split(",") if s.strip()]
+
+
 @setup_logging
 def get_args():
     """
@@ -171,15 +397,22 @@ def get_args():
     ap.add_argument("dataset")
     ap.add_argument("network_name")
     ap.add_argument("output_name")
-    ap.add_argument("seed", type=int, default=42)
+    ap.add_argument("seed", type=seeds_arg, default=[42],
+                    help="Seed, or comma separated seeds for an ensemble")
     ap.add_argument("datefile", type=argparse.FileType("r"))
 
+    ap.add_argument("-b", "--batch-size", dest="batch_size",
+                    help="Dates to predict per network call",
+                    type=int, default=1)
     ap.add_argument("-i", "--train-identifier", dest="ident",
                     help="Train dataset identifier", type=str, default=None)
     ap.add_argument("-n", "--n-filters-factor", type=float, default=1.)
     ap.add_argument("-t", "--testset", action="store_true", default=False)
     ap.add_argument("-v", "--verbose", action="store_true", default=False)
     ap.add_argument("-s", "--save_args", action="store_true", default=False)
+    ap.add_argument("-w", "--workers",
+                    help="Threads generating input samples",
+                    type=int, default=1)
 
     return ap.parse_args()
 
@@ -195,20 +428,27 @@ def main():
              for s in date_content.split()]
     args.datefile.close()
 
-    output_folder = os.path.join(".", "results", "predict",
-                                 args.output_name,
-                                 "{}.{}".format(args.network_name, args.seed))
+    ensemble_folder = os.path.join(".", "results", "predict",
+                                   args.output_name)
+    output_folders = [os.path.join(ensemble_folder,
+                                   "{}.{}".format(args.network_name, seed))
+                      for seed in args.seed]
 
     predict_forecast(dataset_config,
                      args.network_name,
+                     batch_size=args.batch_size,
                      # FIXME: this is turning into a mapping mess,
                      #  do we need to retain the train SD name in the
                      #  network?
                      dataset_name=args.ident if args.ident else args.dataset,
+                     # Mean and stddev are written directly for ensembles
+                     ensemble_folder=ensemble_folder
+                     if len(args.seed) > 1 else None,
                      n_filters_factor=args.n_filters_factor,
-                     output_folder=output_folder,
+                     output_folder=output_folders,
                      save_args=args.save_args,
                      seed=args.seed,
                      start_dates=dates,
-                     test_set=args.testset)
+                     test_set=args.testset,
+                     workers=args.workers)
 
@@ -38,13 +38,23 @@ def tfrecord_args():
 def plot_tfrecord():
     args = tfrecord_args()
 
-    ds = tf.data.TFRecordDataset([args.file])
     config = json.load(args.configuration)
     args.configuration.close()
 
+    ds = tf.data.TFRecordDataset([args.file],
+                                 compression_type=config['compression']
+                                 if 'compression' in config else None)
+
     decoder = get_decoder(tuple(config['shape']),
                           config['num_channels'],
-                          config['n_forecast_days'])
+                          config['n_forecast_days'],
+                          active_cells=np.load(config['active_cells'])
+                          if 'active_cells' in config and
+                          config['active_cells'] else None,
+                          output_dtype=config['output_dtype']
+                          if 'output_dtype' in config else None,
+                          record_version=config['record_version']
+                          if 'record_version' in config else 1)
 
     ds = ds.map(decoder).batch(1)
     it = ds.as_numpy_iterator()
@@ -70,6 +70,22 @@ def region_arg(argument: str):
             "Region argument must be list of four integers")
 
 
+def get_active_cell_weights(masks: object,
+                            obs_da: object) -> object:
+    """
+    Gather the active grid cell mask for each time in obs_da from the month
+    indexed mask cube, lazily, for use as weights in the metrics.
+
+    :param masks: an icenet Masks object
+    :param obs_da: an xarray.DataArray object with time, xc, yc coordinates
+
+    :return: xarray.DataArray of active grid cell masks with time, xc, yc
+             coordinates
+    """
+    return masks.get_active_cell_cube().\
+        sel(month=obs_da.time.dt.month).drop_vars("month")
+
+
 def compute_binary_accuracy(masks: object,
                             fc_da: object,
                             obs_da: object,
@@ -95,7 +111,7 @@ def compute_binary_accuracy(masks: object,
         raise ValueError("threshold must be a float between 0 and 1")
 
     # obtain mask
-    agcm = masks.get_active_cell_da(obs_da)
+    agcm = get_active_cell_weights(masks, obs_da)
 
     # binary for observed (i.e. truth)
     binary_obs_da = obs_da > threshold
@@ -198,7 +214,7 @@ def compute_sea_ice_extent_error(masks: object,
         raise ValueError("threshold must be a float between 0 and 1")
     
     # obtain mask
-    agcm = masks.get_active_cell_da(obs_da)
+    agcm = get_active_cell_weights(masks, obs_da)
     
     # binary for observed (i.e. truth)
     binary_obs_da = obs_da > threshold
@@ -306,7 +322,7 @@ def compute_metrics(metrics: object,
                                       f"Please only choose out of {implemented_metrics}.")
     
     # obtain mask
-    mask_da = masks.get_active_cell_da(obs_da)
+    mask_da = get_active_cell_weights(masks, obs_da)
     
     metric_dict = {}
     # compute raw error
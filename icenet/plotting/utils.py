@@ -6,6 +6,7 @@ import re
 
 import cartopy.crs as ccrs
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import xarray as xr
 
@@ -37,51 +38,33 @@ def broadcast_forecast(start_date: object,
         dataset = xr.open_mfdataset(datafiles, engine="netcdf4")
 
     dates = pd.date_range(start_date, end_date)
-    i = 0
+    times = pd.DatetimeIndex(dataset.time.values)
 
     logging.debug("Dataset summary: \n{}".format(dataset))
 
-    if len(dataset.time.values) > 1:
-        while dataset.time.values[i + 1] < dates[0]:
-            i += 1
-
-    logging.info("Starting index will be {} for {} - {}".
-                 format(i, dates[0], dates[-1]))
-    dt_arr = []
-
-    for d in dates:
-        logging.debug("Looking for date {}".format(d))
-        arr = None
-
-        while arr is None:
-            if d >= dataset.time.values[i]:
-                d_lead = (d - dataset.time.values[i]).days
-
-                if i + 1 < len(dataset.time.values):
-                    if pd.to_datetime(dataset.time.values[i]) + \
-                            dt.timedelta(days=d_lead) >= \
-                            pd.to_datetime(dataset.time.values[i + 1]) + \
-                            dt.timedelta(days=1):
-                        i += 1
-                        continue
-
-                logging.debug("Selecting date {} and lead {}".
-                              format(pd.to_datetime(
-                                     dataset.time.values[i]).strftime("%D"),
-                                     d_lead))
-
-                arr = dataset.sel(time=dataset.time.values[i],
-                                  leadtime=d_lead).\
-                    copy().\
-                    drop("time").\
-                    assign_coords(dict(time=d)).\
-                    drop("leadtime")
-            else:
-                i += 1
+    # Each date is taken from the latest forecast initialised before it
+    init_idx = times.searchsorted(dates, side="left") - 1
+
+    if (init_idx < 0).any():
+        raise KeyError("{} is not after the first forecast {}".format(
+            dates[init_idx < 0][0].date(), times[0].date()))
+
+    leadtimes = (dates - times[init_idx]).days.values
+    lead_idx = pd.Index(dataset.leadtime.values).get_indexer(leadtimes)
+
+    if (lead_idx < 0).any():
+        raise KeyError("{} is beyond the leadtimes of the forecast from {}".
+                       format(dates[lead_idx < 0][0].date(),
+                              times[init_idx[lead_idx < 0][0]].date()))
 
-        dt_arr.append(arr)
+    logging.info("Selecting {} dates from {} forecasts for {} - {}".
+                 format(len(dates), len(np.unique(init_idx)),
+                        dates[0], dates[-1]))
 
-    target_ds = xr.concat(dt_arr, dim="time")
+    target_ds = dataset.isel(time=xr.DataArray(init_idx, dims="time"),
+                             leadtime=xr.DataArray(lead_idx, dims="time")).\
+        drop_vars("leadtime").\
+        assign_coords(dict(time=dates))
 
     if target:
         logging.info("Saving dataset to {}".format(target))
@@ -220,22 +203,29 @@ Coordinates:
 
 def get_forecast_ds(forecast_file: object,
                     forecast_date: str,
-                    stddev: bool = False
+                    stddev: bool = False,
+                    chunks: object = None,
+                    end_date: str = None
                     ) -> object:
     """
 
     :param forecast_file: a path to a .nc file
     :param forecast_date: initialisation date of the forecast
     :param stddev:
+    :param chunks: to open the forecast file lazily with, see xr.open_dataset
+    :param end_date: last initialisation date, defaults to forecast_date
     :returns tuple(fc_ds, obs_ds, land_mask):
     """
     forecast_date = pd.to_datetime(forecast_date)
+    end_date = forecast_date if end_date is None else pd.to_datetime(end_date)
 
-    forecast_ds = xr.open_dataset(forecast_file, decode_coords="all")
+    forecast_ds = xr.open_dataset(forecast_file,
+                                  chunks=chunks,
+                                  decode_coords="all")
     get_key = "sic_mean" if not stddev else "sic_stddev"
 
     forecast_ds = getattr(
-        forecast_ds.sel(time=slice(forecast_date, forecast_date)),
+        forecast_ds.sel(time=slice(forecast_date, end_date)),
         get_key)
 
     return forecast_ds
@@ -1,12 +1,17 @@
 import argparse
+import collections
 import datetime as dt
 import logging
 import os
 
+from concurrent.futures import ProcessPoolExecutor
+
 import cf_units
 import iris
 import pandas as pd
 import rasterio
+# Registers the rio accessor, including in export worker processes
+import rioxarray  # noqa: F401
 
 import iris.analysis
 
@@ -15,6 +20,12 @@ from icenet.utils import setup_logging
 
 from icenet.plotting.utils import broadcast_forecast, get_forecast_ds
 
+# The default 512 pixel tiles would cover the whole grid, leaving no
+# overviews to build
+COG_OPTIONS = dict(blocksize=256,
+                   driver="COG",
+                   overview_resampling="average")
+
 
 def reproject_output(forecast_file: object,
                      proj_file: object,
@@ -92,12 +103,23 @@ def geotiff_args() -> argparse.Namespace:
 
     """
     ap = argparse.ArgumentParser()
+    ap.add_argument("-c", "--cog",
+                    help="Write Cloud-Optimised GeoTIFFs, with overviews",
+                    action="store_true",
+                    default=False)
+    ap.add_argument("-e", "--end-date",
+                    help="Output every forecast date from forecast_date to "
+                         "this date (inclusive) in the forecast file",
+                    default=None)
     ap.add_argument("-o", "--output-path", default=".")
     ap.add_argument("-s", "--stddev",
                     help="Plot the standard deviation from the ensemble",
                     action="store_true",
                     default=False)
     ap.add_argument("-v", "--verbose", default=False, action="store_true")
+    ap.add_argument("-w", "--workers",
+                    help="Processes to write GeoTIFFs with",
+                    default=1, type=int)
     ap.add_argument("forecast_file")
     ap.add_argument("forecast_date")
     ap.add_argument("leadtimes",
@@ -112,6 +134,25 @@ def geotiff_args() -> argparse.Namespace:
     return args
 
 
+def write_geotiff(pred_da: object,
+                  output_filename: str,
+                  cog: bool = False) -> str:
+    """Write a single leadtime of a forecast, run in the export processes
+
+    :param pred_da:
+    :param output_filename:
+    :param cog: write a Cloud-Optimised GeoTIFF, which builds its overviews
+    :return:
+    """
+    logging.debug("Outputting {}".format(output_filename))
+
+    if cog:
+        pred_da.rio.to_raster(output_filename, **COG_OPTIONS)
+    else:
+        pred_da.rio.to_raster(output_filename)
+    return output_filename
+
+
 def create_geotiff_output():
     """CLI entry point for icenet_output_geotiff
 
@@ -128,8 +169,15 @@ def create_geotiff_output():
 
     ds = get_forecast_ds(args.forecast_file,
                          args.forecast_date,
-                         stddev=args.stddev)
-    ds = ds.isel(time=0).transpose(..., "yc", "xc")
+                         stddev=args.stddev,
+                         chunks=dict(time=1),
+                         end_date=args.end_date)
+    ds = ds.transpose(..., "yc", "xc")
+
+    if len(ds.time) == 0:
+        raise RuntimeError("No forecasts in {} from {} to {}".format(
+            args.forecast_file, args.forecast_date,
+            args.end_date or args.forecast_date))
 
     # The projection information set when we create NetCDF output compliant
     # with CF standards still has units as meters, but the attributes on the
@@ -154,23 +202,52 @@ def create_geotiff_output():
         if args.leadtimes is not None \
         else list(range(1, int(max(ds.leadtime.values)) + 1))
 
-    forecast_name = "{}.{}".format(
-        os.path.splitext(os.path.basename(args.forecast_file))[0],
-        args.forecast_date)
-
-    logging.info("Selecting and outputting files from {} for {}".
-                 format(args.forecast_file, args.forecast_date))
-
-    for leadtime in leadtimes:
-        pred_da = ds.sel(leadtime=leadtime)
-
-        output_filename = os.path.join(args.output_path, "{}.{}.{}tiff".format(
-            forecast_name,
-            (pd.to_datetime(args.forecast_date) + dt.timedelta(
-                days=leadtime)).strftime("%Y-%m-%d"),
-            "" if not args.stddev else "stddev."
-        ))
-
-        logging.debug("Outputting leadtime {} to {}".
-                      format(leadtime, output_filename))
-        pred_da.rio.to_raster(output_filename)
+    logging.info("Selecting and outputting files from {} for {} forecasts "
+                 "from {}".format(args.forecast_file, len(ds.time),
+                                  args.forecast_date))
+
+    # A single worker writes in this process, rather than a pool
+    executor = ProcessPoolExecutor(max_workers=args.workers) \
+        if args.workers > 1 else None
+    futures = collections.deque()
+
+    try:
+        for time in ds.time.values:
+            forecast_date = pd.to_datetime(time).strftime("%Y-%m-%d")
+            forecast_name = "{}.{}".format(
+                os.path.splitext(os.path.basename(args.forecast_file))[0],
+                forecast_date)
+
+            # Each forecast date is read once, then its leadtimes are written
+            # in parallel
+            date_da = ds.sel(time=time).load()
+
+            for leadtime in leadtimes:
+                output_filename = os.path.join(
+                    args.output_path, "{}.{}.{}tiff".format(
+                        forecast_name,
+                        (pd.to_datetime(time) + dt.timedelta(
+                            days=leadtime)).strftime("%Y-%m-%d"),
+                        "" if not args.stddev else "stddev."
+                    ))
+
+                if executor is None:
+                    write_geotiff(date_da.sel(leadtime=leadtime),
+                                  output_filename,
+                                  args.cog)
+                else:
+                    futures.append(executor.submit(
+                        write_geotiff,
+                        date_da.sel(leadtime=leadtime),
+                        output_filename,
+                        args.cog))
+
+            # Limit the forecast dates held in memory by pending writes
+            while len(futures) > len(leadtimes) * 2:
+                futures.popleft().result()
+
+        for future in futures:
+            future.result()
+    finally:
+        if executor is not None:
+            executor.shutdown()
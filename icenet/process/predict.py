@@ -5,6 +5,8 @@ import logging
 import os
 import re
 
+import dask
+import dask.array as da
 import iris
 import numpy as np
 import pandas as pd
@@ -13,6 +15,7 @@ import xarray as xr
 from icenet import __version__ as icenet_version
 from icenet.data.dataset import IceNetDataSet
 from icenet.data.sic.mask import Masks
+from icenet.model.predict import get_ensemble_stats
 from icenet.utils import run_command, setup_logging
 
 
@@ -83,14 +86,76 @@ def get_prediction_data(root: object,
         logging.warning("No files found")
         return None
 
-    data = [np.load(f) for f in np_files]
-    data = np.array(data)
+    # Ensemble predictions write the mean and stddev directly, which is
+    # used if it covers the same members and none have been rerun since
+    ensemble_path = os.path.join(root,
+                                 "results",
+                                 "predict",
+                                 name,
+                                 date.strftime("%Y_%m_%d.npz"))
 
-    logging.debug("Data read from disk: {} from: {}".format(data.shape, np_files))
+    if os.path.exists(ensemble_path) and \
+            os.path.getmtime(ensemble_path) >= \
+            max([os.path.getmtime(f) for f in np_files]):
+        with np.load(ensemble_path) as ensemble:
+            members = set([os.path.basename(os.path.dirname(f))
+                           for f in np_files])
 
-    return np.stack(
-        [data.mean(axis=0), data.std(axis=0)],
-        axis=-1).squeeze()
+            if set(ensemble["members"]) == members:
+                logging.debug("Ensemble data read from disk: {}".
+                              format(ensemble_path))
+                return ensemble["stats"]
+
+    logging.debug("Data read from disk: {} members from: {}".
+                  format(len(np_files), np_files))
+
+    return get_ensemble_stats(np.load(f, mmap_mode="r") for f in np_files)
+
+
+def get_forecast_data(root: object,
+                      name: object,
+                      date: object) -> object:
+    """Ensemble prediction data for a single date
+
+    :param root:
+    :param name:
+    :param date:
+    :return: array of mean and stddev, stacked on the last axis
+    """
+    data = get_prediction_data(root, name, date)
+
+    if data is None:
+        raise RuntimeError("No prediction data for {}".format(date))
+    return data
+
+
+def get_forecast_mask(mask_gen: object,
+                      dates: object,
+                      n_leadtimes: int) -> object:
+    """Lazy mask of the active, non-land cells for every forecast leadtime
+
+    The monthly active cell masks are combined with the land mask into a
+    single (12, yc, xc) stack, which is gathered for each date from a table
+    of the month of every (date, leadtime).
+
+    :param mask_gen: Masks to use
+    :param dates: forecast initialisation dates
+    :param n_leadtimes:
+    :return: boolean dask array of (time, yc, xc, leadtime), chunked by date
+    """
+    lead_dates = pd.DatetimeIndex(dates).values[:, np.newaxis] + \
+        pd.to_timedelta(np.arange(1, n_leadtimes + 1), unit="D").values
+    month_table = pd.DatetimeIndex(lead_dates.ravel()).month.values.\
+        reshape(lead_dates.shape) - 1
+
+    mask_stack = mask_gen.get_active_cell_masks() & \
+        ~mask_gen.get_land_mask()[np.newaxis]
+
+    return da.from_array(month_table, chunks=(1, n_leadtimes)).map_blocks(
+        lambda months: mask_stack[months].transpose(0, 2, 3, 1),
+        chunks=(1, *mask_stack.shape[1:], n_leadtimes),
+        dtype=bool,
+        new_axis=[1, 2])
 
 
 def date_arg(string: str) -> object:
@@ -114,6 +179,10 @@ def get_args():
     ap.add_argument("dataset")
     ap.add_argument("datefile", type=argparse.FileType("r"))
 
+    ap.add_argument("-d", "--daily",
+                    help="Write a file per forecast date into a directory "
+                         "named after the output, rather than a single file",
+                    default=False, action="store_true")
     ap.add_argument("-m", "--mask", default=False, action="store_true")
     ap.add_argument("-o", "--output-dir", default=".")
     ap.add_argument("-r", "--root", type=str, default=".")
@@ -140,38 +209,25 @@ def create_cf_output():
              for s in args.datefile.read().split()]
     args.datefile.close()
 
-    arr = np.array(
-        [get_prediction_data(args.root, args.name, date)
-         for date in dates])
+    # Dates are loaded and aggregated lazily as the output is written, so
+    # only the dates being written are held in memory
+    first = get_forecast_data(args.root, args.name, dates[0])
+    arr = da.stack([da.from_array(first)] + [
+        da.from_delayed(dask.delayed(get_forecast_data)(
+            args.root, args.name, date),
+            shape=first.shape, dtype=first.dtype)
+        for date in dates[1:]])
 
     logging.info("Dataset arr shape: {}".format(arr.shape))
 
-    sic_mean = arr[..., 0]
-    sic_stddev = arr[..., 1]
-
     if args.mask:
-        mask_gen = Masks(north=ds.north, south=ds.south)
+        logging.info("Land and active grid cell masking the forecast output")
+        mask = get_forecast_mask(Masks(north=ds.north, south=ds.south),
+                                 dates, arr.shape[3])
+        arr = da.where(mask[..., np.newaxis], arr, 0).astype(arr.dtype)
 
-        logging.info("Land masking the forecast output")
-        land_mask = mask_gen.get_land_mask()
-        mask = land_mask[np.newaxis, ..., np.newaxis]
-        mask = np.repeat(mask, sic_mean.shape[-1], axis=-1)
-        mask = np.repeat(mask, sic_mean.shape[0], axis=0)
-
-        sic_mean[mask] = 0
-        sic_stddev[mask] = 0
-
-        logging.info("Applying active grid cell masks")
-
-        for idx, forecast_date in enumerate(dates):
-            for lead_idx in np.arange(0, arr.shape[3], 1):
-                lead_dt = forecast_date + dt.timedelta(days=int(lead_idx) + 1)
-                logging.debug("Active grid cell mask start {} forecast date {}".
-                              format(forecast_date, lead_dt))
-
-                grid_cell_mask = mask_gen.get_active_cell_mask(lead_dt.month)
-                sic_mean[idx, ~grid_cell_mask, lead_idx] = 0
-                sic_stddev[idx, ~grid_cell_mask, lead_idx] = 0
+    sic_mean = arr[..., 0]
+    sic_stddev = arr[..., 1]
 
     xarr = xr.Dataset(
         data_vars=dict(
@@ -314,7 +370,28 @@ def create_cf_output():
         units="1",
     )
 
-    # TODO: split into daily files
-    output_path = os.path.join(args.output_dir, "{}.nc".format(args.name))
-    logging.info("Saving to {}".format(output_path))
-    xarr.to_netcdf(output_path)
+    # Chunking by date, with every leadtime in the chunk, means a single
+    # forecast can be read without decompressing any other
+    for var_name in ("sic_mean", "sic_stddev"):
+        xarr[var_name].encoding.update(dict(
+            chunksizes=(1, *xarr[var_name].shape[1:]),
+            complevel=4,
+            zlib=True,
+        ))
+
+    if args.daily:
+        output_folder = os.path.join(args.output_dir, args.name)
+        os.makedirs(output_folder, exist_ok=True)
+
+        output_paths = [os.path.join(output_folder, "{}.nc".format(
+            pd.to_datetime(date).strftime("%Y_%m_%d")))
+            for date in xarr.time.values]
+        logging.info("Saving {} daily files to {}".
+                     format(len(output_paths), output_folder))
+        xr.save_mfdataset([xarr.isel(time=[idx])
+                           for idx in range(len(output_paths))],
+                          output_paths)
+    else:
+        output_path = os.path.join(args.output_dir, "{}.nc".format(args.name))
+        logging.info("Saving to {}".format(output_path))
+        xarr.to_netcdf(output_path)
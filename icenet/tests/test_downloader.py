@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+"""Tests for the regridding of downloads in `icenet` package."""
+
+import pickle
+
+import iris.cube
+import numpy as np
+import pytest
+import scipy.sparse
+
+from icenet.data.interfaces.downloader import ClimateDownloader
+
+
+class RegridDownloader(ClimateDownloader):
+    def additional_regrid_processing(self, datafile, cube_ease):
+        pass
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    downloader = RegridDownloader(identifier="test",
+                                  levels=[None],
+                                  max_threads=2,
+                                  path=str(tmp_path / "data"),
+                                  var_names=["tas"])
+    downloader._sic_ease_cubes[downloader.hemisphere] = \
+        iris.cube.Cube(np.zeros((2, 2)), long_name="sea_ice_area_fraction")
+    return downloader
+
+
+def test_regrid_state_pickles(downloader):
+    downloader._files_downloaded = ["latlon_2020.nc"]
+    downloader._regrid_weights["key"] = scipy.sparse.identity(4, format="csr")
+
+    state = pickle.loads(pickle.dumps(downloader))
+
+    assert state._files_downloaded == []
+    assert (state._regrid_weights["key"] !=
+            downloader._regrid_weights["key"]).nnz == 0
+    assert state._regrid_weights_lock is not downloader._regrid_weights_lock
+    assert state.sic_ease_cube == downloader.sic_ease_cube
+
+
+def test_regrid_raises_failures(downloader, tmp_path):
+    files = [str(tmp_path / "tas" / "latlon_{}.nc".format(year))
+             for year in (2020, 2021)]
+
+    with pytest.raises(RuntimeError, match="failed for 2 of 2 tasks"):
+        downloader.regrid(files, rotate_wind=False, retries=1)
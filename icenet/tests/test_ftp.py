@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""Tests for the pooled FTP downloads in `icenet` package."""
+
+import json
+import os
+import threading
+
+import pytest
+
+from icenet.data.sic.ftp import FTPPool
+
+pyftpdlib = pytest.importorskip("pyftpdlib")
+
+from pyftpdlib.authorizers import DummyAuthorizer  # noqa: E402
+from pyftpdlib.handlers import FTPHandler  # noqa: E402
+from pyftpdlib.servers import ThreadedFTPServer  # noqa: E402
+
+
+@pytest.fixture
+def ftp_server(tmp_path):
+    """Local anonymous FTP server, serving a month of daily files."""
+    root = tmp_path / "server"
+    month = root / "2020" / "01"
+    month.mkdir(parents=True)
+
+    for day in range(1, 11):
+        (month / "ice_conc_nh_202001{:02d}.nc".format(day)).\
+            write_bytes(os.urandom(4096 + day))
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(str(root))
+    handler = type("Handler", (FTPHandler, ), dict(authorizer=authorizer))
+
+    server = ThreadedFTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs=dict(timeout=0.1))
+    thread.start()
+
+    yield server.address[1], month
+
+    server.close_all()
+    thread.join()
+
+
+def test_concurrent_retrieve(ftp_server, tmp_path):
+    port, month = ftp_server
+    cache_path = str(tmp_path / "listing.json")
+
+    with FTPPool("127.0.0.1", cache_path=cache_path,
+                 connections=3, port=port) as pool:
+        listing = pool.nlst("/2020/01/")
+        assert sorted(listing) == sorted(os.listdir(month))
+
+        threads = [threading.Thread(target=pool.retrieve,
+                                    args=("/2020/01/{}".format(filename),
+                                          str(tmp_path / filename)))
+                   for filename in listing]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for filename in listing:
+            assert (tmp_path / filename).read_bytes() == \
+                (month / filename).read_bytes()
+        assert pool.stats["files"] == len(listing)
+
+    with open(cache_path) as fh:
+        assert json.load(fh)["/2020/01/"] == listing
+
+
+def test_listing_cache(ftp_server, tmp_path):
+    port, month = ftp_server
+    cache_path = str(tmp_path / "listing.json")
+
+    with FTPPool("127.0.0.1", cache_path=cache_path, port=port) as pool:
+        pool.nlst("/2020/01/")
+
+    (month / "ice_conc_nh_20200111.nc").write_bytes(b"new")
+
+    with FTPPool("127.0.0.1", cache_path=cache_path, port=port) as pool:
+        assert "ice_conc_nh_20200111.nc" not in pool.nlst("/2020/01/")
+        assert "ice_conc_nh_20200111.nc" in \
+            pool.nlst("/2020/01/", refresh=True)
+
+
+def test_resume_partial(ftp_server, tmp_path):
+    port, month = ftp_server
+    filename = "ice_conc_nh_20200101.nc"
+    destination = tmp_path / filename
+    content = (month / filename).read_bytes()
+
+    # Left by an interrupted transfer
+    (tmp_path / "{}.part".format(filename)).write_bytes(content[:1000])
+
+    with FTPPool("127.0.0.1", port=port) as pool:
+        pool.retrieve("/2020/01/{}".format(filename), str(destination))
+        assert pool.stats["bytes"] == len(content) - 1000
+
+    assert destination.read_bytes() == content
+    assert not os.path.exists("{}.part".format(destination))
+
+
+def test_concurrent_listing(ftp_server, tmp_path, monkeypatch):
+    port, month = ftp_server
+    listings = list()
+
+    retry = FTPPool._retry
+
+    def counted_retry(self, description, *args, **kwargs):
+        if description.startswith("listing"):
+            listings.append(description)
+        return retry(self, description, *args, **kwargs)
+
+    monkeypatch.setattr(FTPPool, "_retry", counted_retry)
+
+    with FTPPool("127.0.0.1", cache_path=str(tmp_path / "listing.json"),
+                 connections=4, port=port) as pool:
+        results = list()
+        threads = [threading.Thread(
+            target=lambda: results.append(
+                pool.nlst("/2020/01/", refresh=True)))
+            for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert listings == ["listing /2020/01/"]
+    assert all(result == results[0] for result in results)
+    assert sorted(results[0]) == sorted(os.listdir(month))
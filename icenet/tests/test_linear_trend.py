@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""Tests for the vectorised linear trend in `icenet` package."""
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import icenet.data.process
+from icenet.data.process import IceNetPreProcessor
+from icenet.data.processors.utils import LinearTrendCache
+from icenet.model.models import linear_trend_forecast, linear_trend_forecasts
+
+
+SHAPE = (6, 5)
+
+
+@pytest.fixture
+def trend_data():
+    """Daily data over 38 years, with NaNs and missing dates."""
+    rng = np.random.default_rng(42)
+    dates = pd.date_range("1980-01-01", "2017-12-31")
+    years = (dates.year - dates.year[0]).values[:, np.newaxis, np.newaxis]
+
+    data = 0.3 + 0.01 * years + \
+        rng.normal(0, 0.1, (len(dates), *SHAPE)).astype(np.float32)
+    data[rng.random(data.shape) < 0.0005] = np.nan
+
+    da = xr.DataArray(data,
+                      dims=("time", "yc", "xc"),
+                      coords=dict(time=dates))
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[0, :] = True
+
+    missing_dates = pd.DatetimeIndex(rng.choice(dates, 200, replace=False))
+
+    # Forecasts before any data, with a single year, fewer than and more
+    # than max_years of data, and past the end of the data
+    forecast_dates = pd.DatetimeIndex(sorted(set(
+        list(pd.date_range("1979-12-25", "1981-01-10")) +
+        list(pd.date_range("2000-02-20", "2000-03-05")) +
+        list(pd.date_range("2016-06-01", "2016-06-30")) +
+        list(pd.date_range("2017-12-20", "2018-01-31")))))
+    return da, forecast_dates, mask, missing_dates
+
+
+def loop_forecasts(da, forecast_dates, mask, missing_dates, max_years=35):
+    """The per date implementation previously used in preprocessing."""
+    def data_selector(da,
+                      processing_date,
+                      missing_dates=tuple()):
+        target_date = pd.to_datetime(processing_date)
+
+        date_da = da[(da.time['time.month'] == target_date.month) &
+                     (da.time['time.day'] == target_date.day) &
+                     (da.time <= target_date) &
+                     ~da.time.isin(missing_dates)].\
+            isel(time=slice(0, max_years))
+        return date_da
+
+    return np.stack([
+        linear_trend_forecast(data_selector, forecast_date, da, mask,
+                              missing_dates=missing_dates, shape=SHAPE)
+        for forecast_date in forecast_dates])
+
+
+def test_linear_trend_forecasts_match(trend_data):
+    da, forecast_dates, mask, missing_dates = trend_data
+
+    expected = loop_forecasts(da, forecast_dates, mask, missing_dates)
+    output = linear_trend_forecasts(da, forecast_dates, mask,
+                                    missing_dates=missing_dates,
+                                    shape=SHAPE)
+
+    assert output.shape == expected.shape
+    np.testing.assert_array_equal(np.isnan(output), np.isnan(expected))
+    np.testing.assert_allclose(output, expected, atol=1e-6)
+
+
+@pytest.mark.skipif(not os.environ.get("ICENET_BENCHMARK"),
+                    reason="Benchmarks only run with ICENET_BENCHMARK set")
+def test_linear_trend_forecasts_benchmark(trend_data):
+    da, forecast_dates, mask, missing_dates = trend_data
+
+    start = time.time()
+    loop_forecasts(da, forecast_dates, mask, missing_dates)
+    loop_time = time.time() - start
+
+    start = time.time()
+    linear_trend_forecasts(da, forecast_dates, mask,
+                           missing_dates=missing_dates, shape=SHAPE)
+    vectorised_time = time.time() - start
+
+    print("{} forecasts: per date {:.3f}s, vectorised {:.3f}s".format(
+        len(forecast_dates), loop_time, vectorised_time))
+
+
+@pytest.mark.parametrize("store", ["netcdf", "zarr"])
+def test_linear_trend_append_matches_reprocess(trend_data, tmp_path,
+                                               monkeypatch, store):
+    da, _, mask, missing_dates = trend_data
+    da = da.sel(time=slice("2015-01-01", "2017-12-31"))
+    last_date = pd.Timestamp("2017-06-30")
+
+    class FakeMasks:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def get_land_mask(self):
+            return mask
+
+    monkeypatch.setattr(icenet.data.process, "Masks", FakeMasks)
+
+    def trend(name, *calls):
+        processor = IceNetPreProcessor(["siconca"], [], name, [], [], [],
+                                       data_shape=SHAPE,
+                                       identifier="test",
+                                       linear_trend_steps=7,
+                                       missing_dates=missing_dates,
+                                       path=str(tmp_path),
+                                       store=store,
+                                       update_loader=False)
+        for input_da, kwargs in calls:
+            processor._build_linear_trend_da(input_da, "siconca", **kwargs)
+        return processor._open_processed_file("siconca",
+                                              "siconca_linear_trend").load()
+
+    expected = trend("full", (da, dict()))
+    output = trend("append",
+                   (da.sel(time=slice(None, last_date)), dict()),
+                   (da.sel(time=slice(last_date + pd.Timedelta(days=1),
+                                      None)),
+                    dict(last_date=last_date.to_datetime64(), ref_da=da)))
+
+    np.testing.assert_array_equal(output.time.values, expected.time.values)
+    np.testing.assert_allclose(output.values, expected.values, atol=1e-6)
+
+
+def test_linear_trend_cache_inputs(trend_data, tmp_path):
+    da, _, _, _ = trend_data
+    da = da.sel(time=slice("2016-01-01", "2017-12-31"))
+    path = str(tmp_path / "siconca_linear_trend_cache.zarr")
+    maps = da.isel(time=slice(0, 10)).rename("siconca_linear_trend")
+
+    def cache(ref_da=da, **settings):
+        return LinearTrendCache(path, "siconca_linear_trend",
+                                ref_da=ref_da,
+                                settings=dict(max_years=35, **settings))
+
+    cache().put(maps)
+    found, cached_maps = cache().get(maps.time.values)
+    assert len(found) == 10
+    np.testing.assert_array_equal(cached_maps, maps.values)
+
+    # Data appended after the cached maps were fitted leaves them valid
+    longer_da = xr.concat([da, da.isel(time=[-1]).assign_coords(
+        time=[pd.Timestamp("2018-01-01")])], dim="time")
+    assert len(cache(ref_da=longer_da).get(maps.time.values)[0]) == 10
+
+    changed_da = da.copy(data=da.values + 1)
+    assert len(cache(ref_da=changed_da).get(maps.time.values)[0]) == 0
+    assert len(cache(missing_dates=["2016-01-02"]).
+               get(maps.time.values)[0]) == 0
+
+    # Caching with other inputs replaces the maps
+    cache(missing_dates=["2016-01-02"]).put(maps.isel(time=slice(0, 2)))
+    assert len(cache(missing_dates=["2016-01-02"]).
+               get(maps.time.values)[0]) == 2
+    assert len(cache().get(maps.time.values)[0]) == 0
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+"""Tests for the OSI-SAF SIC downloader in `icenet` package."""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import icenet.data.sic.osisaf
+from icenet.data.sic.osisaf import SICDownloader
+
+
+SHAPE = (3, 4)
+
+
+class FakeMasks:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_active_cell_mask(self, month):
+        return np.ones(SHAPE, dtype=bool)
+
+
+def test_missing_dates_interpolation(tmp_path, monkeypatch):
+    monkeypatch.setattr(icenet.data.sic.osisaf, "Masks", FakeMasks)
+
+    dates = pd.date_range("2020-03-01", "2020-03-08")
+    obs_dates = dates[[0, 1, 3, 7]]
+
+    rng = np.random.default_rng(42)
+    data = rng.random((len(obs_dates), *SHAPE)).astype(np.float32)
+    data[1, 0, 0] = np.nan
+    data[2, 1, 1] = np.nan
+
+    da = xr.DataArray(data,
+                      dims=("time", "yc", "xc"),
+                      coords=dict(time=obs_dates),
+                      name="ice_conc")
+    expected = xr.concat([da, da.interp(time=dates.difference(obs_dates))],
+                         dim="time").sortby("time")
+
+    downloader = SICDownloader(dates=[date.date() for date in dates],
+                               path=str(tmp_path))
+    output = downloader._missing_dates(da)
+
+    np.testing.assert_array_equal(output.time.values, dates.values)
+    np.testing.assert_allclose(output.values, expected.values, rtol=1e-6)
+
+    # NaNs in observations are kept, and carried to the dates either side
+    assert np.isnan(output.sel(time="2020-03-02").values[0, 0])
+    assert np.isnan(output.sel(time="2020-03-03").values[0, 0])
+    assert np.isnan(output.sel(time="2020-03-06").values[1, 1])